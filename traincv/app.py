@@ -1,3 +1,4 @@
+import logging
 import os
 import sys
 
@@ -14,6 +15,14 @@ from traincv.views.mainwindow import MainWindow
 
 
 def main():
+    # Headless commands
+    if len(sys.argv) > 1 and sys.argv[1] == "autolabel":
+        from traincv.services import auto_labeling
+
+        logging.getLogger().setLevel(logging.INFO)
+        args = auto_labeling.build_arg_parser().parse_args(sys.argv[2:])
+        sys.exit(auto_labeling.main(args))
+
     # Enable scaling for high dpi screens
     QtWidgets.QApplication.setAttribute(
         QtCore.Qt.AA_EnableHighDpiScaling, True
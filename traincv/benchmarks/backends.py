@@ -0,0 +1,137 @@
+"""
+Compare inference backends on the same model
+Example:
+    python -m traincv.benchmarks.backends --config model.yaml \
+        --backend opencv --backend onnxruntime --threads 4
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+from imutils import paths
+
+from traincv.services.yolov5 import YOLOv5Predictor
+
+
+def load_images(images_path, num_images, image_size):
+    """Load images from a folder, or generate random images"""
+    if images_path:
+        images = []
+        for image_path in sorted(paths.list_images(images_path)):
+            image = cv2.imread(image_path)
+            if image is not None:
+                images.append(image)
+            if len(images) >= num_images:
+                break
+        if len(images) == 0:
+            raise Exception(f"No image found in: {images_path}")
+        return images
+
+    rng = np.random.default_rng(42)
+    return [
+        rng.integers(0, 256, (image_size, image_size, 3), dtype=np.uint8)
+        for _ in range(num_images)
+    ]
+
+
+def benchmark_backend(config_path, backend, backend_options, images, runs):
+    """Return per-image latencies (seconds) of a backend"""
+    predictor = YOLOv5Predictor(
+        config_path,
+        config_overrides={
+            "backend": backend,
+            "backend_options": backend_options,
+            # Disable caching so that every run hits the network
+            "cache_size": 0,
+            "cache_dir": None,
+        },
+    )
+    predictor.warm_up()
+
+    latencies = []
+    for _ in range(runs):
+        for image in images:
+            start = time.perf_counter()
+            predictor.predict(image)
+            latencies.append(time.perf_counter() - start)
+    return np.array(latencies)
+
+
+def main(args):
+    images = load_images(args.images, args.num_images, args.image_size)
+    backend_options = {}
+    if args.threads:
+        backend_options = {
+            "num_threads": args.threads,
+            "intra_op_num_threads": args.threads,
+            "inter_op_num_threads": 1,
+        }
+    if args.graph_optimization_level:
+        backend_options[
+            "graph_optimization_level"
+        ] = args.graph_optimization_level
+
+    print(
+        f"{'backend':<12} {'mean (ms)':>10} {'p50 (ms)':>10}"
+        f" {'p95 (ms)':>10} {'images/s':>10}"
+    )
+    for backend in args.backend or ["opencv", "onnxruntime"]:
+        latencies = benchmark_backend(
+            args.config, backend, backend_options, images, args.runs
+        )
+        print(
+            f"{backend:<12} {latencies.mean() * 1000:>10.2f}"
+            f" {np.percentile(latencies, 50) * 1000:>10.2f}"
+            f" {np.percentile(latencies, 95) * 1000:>10.2f}"
+            f" {len(latencies) / latencies.sum():>10.2f}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        "Compare inference backends on the same model"
+    )
+    parser.add_argument(
+        "--config", type=str, required=True, help="Model config file (yaml)"
+    )
+    parser.add_argument(
+        "--backend",
+        action="append",
+        help="Backend to benchmark. Default: opencv and onnxruntime",
+    )
+    parser.add_argument(
+        "--images",
+        type=str,
+        required=False,
+        help="Image folder. Default: random images",
+    )
+    parser.add_argument(
+        "--num_images", type=int, default=10, help="Number of images"
+    )
+    parser.add_argument(
+        "--image_size",
+        type=int,
+        default=1280,
+        help="Size of random images",
+    )
+    parser.add_argument(
+        "--runs", type=int, default=5, help="Number of runs over all images"
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=os.cpu_count(),
+        help="Number of inference threads",
+    )
+    parser.add_argument(
+        "--graph_optimization_level",
+        type=str,
+        required=False,
+        help="ONNX Runtime graph optimization level",
+    )
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,137 @@
+"""
+Compare header-only image metadata reading against full decoding
+Example:
+    python -m traincv.benchmarks.image_metadata --images path/to/jpegs \
+        --num_images 200
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+import PIL.Image
+from imutils import paths
+
+from traincv.common.image_metadata import read_image_metadata
+
+
+def generate_images(output_path, num_images, width, height):
+    """Write random JPEG images and return their paths"""
+    os.makedirs(output_path, exist_ok=True)
+    rng = np.random.default_rng(42)
+    image_paths = []
+    for i in range(num_images):
+        image = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+        image_path = os.path.join(output_path, f"{i:05d}.jpg")
+        cv2.imwrite(image_path, image)
+        image_paths.append(image_path)
+    return image_paths
+
+
+def read_size_header(image_path):
+    metadata = read_image_metadata(image_path)
+    return metadata.width, metadata.height
+
+
+def read_size_opencv(image_path):
+    image = cv2.imread(image_path)
+    return image.shape[1], image.shape[0]
+
+
+def read_size_pil(image_path):
+    with PIL.Image.open(image_path) as image:
+        image.load()
+        return image.size
+
+
+METHODS = {
+    "header": read_size_header,
+    "opencv_decode": read_size_opencv,
+    "pil_decode": read_size_pil,
+}
+
+
+def benchmark(method, image_paths, runs):
+    """Return per-image latencies (seconds) of a method"""
+    latencies = []
+    for _ in range(runs):
+        for image_path in image_paths:
+            start = time.perf_counter()
+            method(image_path)
+            latencies.append(time.perf_counter() - start)
+    return np.array(latencies)
+
+
+def main(args):
+    if args.images:
+        image_paths = sorted(paths.list_images(args.images))
+        image_paths = image_paths[: args.num_images]
+        if len(image_paths) == 0:
+            raise Exception(f"No image found in: {args.images}")
+    else:
+        image_paths = generate_images(
+            args.generated_path,
+            args.num_images,
+            args.image_width,
+            args.image_height,
+        )
+
+    # All methods must agree on image sizes
+    for image_path in image_paths:
+        sizes = {method(image_path) for method in METHODS.values()}
+        if len(sizes) != 1:
+            print(f"Size mismatch on {image_path}: {sizes}")
+
+    print(
+        f"{'method':<14} {'mean (ms)':>10} {'p50 (ms)':>10}"
+        f" {'p95 (ms)':>10} {'images/s':>10}"
+    )
+    for name, method in METHODS.items():
+        latencies = benchmark(method, image_paths, args.runs)
+        print(
+            f"{name:<14} {latencies.mean() * 1000:>10.3f}"
+            f" {np.percentile(latencies, 50) * 1000:>10.3f}"
+            f" {np.percentile(latencies, 95) * 1000:>10.3f}"
+            f" {len(latencies) / latencies.sum():>10.2f}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        "Compare header-only image metadata reading against full decoding"
+    )
+    parser.add_argument(
+        "--images",
+        type=str,
+        required=False,
+        help="Image folder. Default: generated JPEG images",
+    )
+    parser.add_argument(
+        "--num_images", type=int, default=50, help="Number of images"
+    )
+    parser.add_argument(
+        "--runs", type=int, default=3, help="Number of runs over all images"
+    )
+    parser.add_argument(
+        "--generated_path",
+        type=str,
+        default="benchmark_images",
+        help="Folder of generated images",
+    )
+    parser.add_argument(
+        "--image_width",
+        type=int,
+        default=4000,
+        help="Width of generated images",
+    )
+    parser.add_argument(
+        "--image_height",
+        type=int,
+        default=3000,
+        help="Height of generated images",
+    )
+    sys.exit(main(parser.parse_args()))
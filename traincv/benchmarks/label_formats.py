@@ -0,0 +1,153 @@
+"""
+Compare load time and size of labelme JSON and compact label files
+A synthetic dataset of polygons is written in both formats, 1M vertices by
+default.
+Example:
+    python -m traincv.benchmarks.label_formats --num_files 1000 \
+        --shapes_per_file 50 --points_per_shape 20
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+from traincv.common.compact_label import (COMPACT_LABEL_SUFFIX,
+                                          read_compact_label)
+from traincv.trainer.data.convert_labels import json_to_compact
+from traincv.views.labeling.labelme import __version__
+from traincv.views.labeling.labelme.label_file import LabelFile
+
+
+def generate_labels(output_path, num_files, shapes_per_file, points_per_shape):
+    """Write labelme JSON files of random polygons, return their paths"""
+    os.makedirs(output_path, exist_ok=True)
+    rng = np.random.default_rng(42)
+    label_paths = []
+    for i in range(num_files):
+        points = rng.uniform(0, 4000, (shapes_per_file, points_per_shape, 2))
+        data = {
+            "version": __version__,
+            "flags": {},
+            "shapes": [
+                {
+                    "label": f"object_{j % 10}",
+                    "text": "",
+                    "points": shape_points.round(3).tolist(),
+                    "group_id": None,
+                    "shape_type": "polygon",
+                    "flags": {},
+                }
+                for j, shape_points in enumerate(points)
+            ],
+            "imagePath": f"{i:05d}.jpg",
+            "imageData": None,
+            "imageHeight": 4000,
+            "imageWidth": 4000,
+        }
+        label_path = os.path.join(output_path, f"{i:05d}.json")
+        # Same formatting as LabelFile.save
+        with open(label_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+        label_paths.append(label_path)
+    return label_paths
+
+
+def load_json(label_path):
+    with open(label_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def load_compact(label_path):
+    return read_compact_label(label_path)[0]
+
+
+def load_label_file(label_path):
+    return LabelFile(label_path, lazy=True)
+
+
+# Method name: (label file extension, load function)
+METHODS = {
+    "json": (".json", load_json),
+    "compact": (COMPACT_LABEL_SUFFIX, load_compact),
+    "LabelFile json": (".json", load_label_file),
+    "LabelFile compact": (COMPACT_LABEL_SUFFIX, load_label_file),
+}
+
+
+def benchmark(method, label_paths, runs):
+    """Return per-file latencies (seconds) of a load function"""
+    latencies = []
+    for _ in range(runs):
+        for label_path in label_paths:
+            start = time.perf_counter()
+            method(label_path)
+            latencies.append(time.perf_counter() - start)
+    return np.array(latencies)
+
+
+def main(args):
+    json_paths = generate_labels(
+        args.generated_path,
+        args.num_files,
+        args.shapes_per_file,
+        args.points_per_shape,
+    )
+    for json_path in json_paths:
+        json_to_compact(
+            json_path, os.path.splitext(json_path)[0] + COMPACT_LABEL_SUFFIX
+        )
+    num_points = args.num_files * args.shapes_per_file * args.points_per_shape
+    print(f"{len(json_paths)} files, {num_points} vertices")
+
+    for extension in (".json", COMPACT_LABEL_SUFFIX):
+        size = sum(
+            os.path.getsize(os.path.splitext(path)[0] + extension)
+            for path in json_paths
+        )
+        print(f"{extension:<8} {size / 1024 / 1024:>10.2f} MB")
+
+    print(
+        f"{'method':<18} {'mean (ms)':>10} {'p50 (ms)':>10}"
+        f" {'p95 (ms)':>10} {'total (s)':>10}"
+    )
+    for name, (extension, method) in METHODS.items():
+        label_paths = [
+            os.path.splitext(path)[0] + extension for path in json_paths
+        ]
+        latencies = benchmark(method, label_paths, args.runs)
+        print(
+            f"{name:<18} {latencies.mean() * 1000:>10.3f}"
+            f" {np.percentile(latencies, 50) * 1000:>10.3f}"
+            f" {np.percentile(latencies, 95) * 1000:>10.3f}"
+            f" {latencies.sum() / args.runs:>10.3f}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        "Compare load time and size of labelme JSON and compact label files"
+    )
+    parser.add_argument(
+        "--num_files", type=int, default=1000, help="Number of label files"
+    )
+    parser.add_argument(
+        "--shapes_per_file", type=int, default=50, help="Polygons per file"
+    )
+    parser.add_argument(
+        "--points_per_shape", type=int, default=20, help="Points per polygon"
+    )
+    parser.add_argument(
+        "--runs", type=int, default=3, help="Number of runs over all files"
+    )
+    parser.add_argument(
+        "--generated_path",
+        type=str,
+        default="benchmark_labels",
+        help="Folder of generated label files",
+    )
+    sys.exit(main(parser.parse_args()))
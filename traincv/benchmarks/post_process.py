@@ -0,0 +1,158 @@
+"""
+Check YOLOv5 post-processing against the original per-row loop
+Random network outputs are post-processed by YOLOv5Predictor.post_process
+and by the reference loop, results must be exactly the same. Exit code is 1
+on any mismatch.
+Example:
+    python -m traincv.benchmarks.post_process --runs 20
+"""
+
+import argparse
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from traincv.services.yolov5 import YOLOv5Predictor
+
+NUM_ROWS = 25200
+NUM_CLASSES = 80
+CONFIG = {
+    "input_width": 640,
+    "input_height": 640,
+    "score_threshold": 0.5,
+    "nms_threshold": 0.45,
+    "confidence_threshold": 0.45,
+}
+
+
+def reference_post_process(config, classes, input_image, outputs):
+    """Original post-processing, one Python iteration per row"""
+    class_ids = []
+    confidences = []
+    boxes = []
+    rows = outputs[0].shape[1]
+    image_height, image_width = input_image.shape[:2]
+    x_factor = image_width / config["input_width"]
+    y_factor = image_height / config["input_height"]
+    for r in range(rows):
+        row = outputs[0][0][r]
+        confidence = row[4]
+        if confidence >= config["confidence_threshold"]:
+            classes_scores = row[5:]
+            class_id = np.argmax(classes_scores)
+            if classes_scores[class_id] > config["score_threshold"]:
+                confidences.append(confidence)
+                class_ids.append(class_id)
+                cx, cy, w, h = row[0], row[1], row[2], row[3]
+                left = int((cx - w / 2) * x_factor)
+                top = int((cy - h / 2) * y_factor)
+                width = int(w * x_factor)
+                height = int(h * y_factor)
+                boxes.append(np.array([left, top, width, height]))
+
+    indices = cv2.dnn.NMSBoxes(
+        boxes,
+        confidences,
+        config["confidence_threshold"],
+        config["nms_threshold"],
+    )
+    output_boxes = []
+    for i in np.array(indices).reshape(-1):
+        left, top, width, height = boxes[i]
+        output_boxes.append(
+            {
+                "x1": left,
+                "y1": top,
+                "x2": left + width,
+                "y2": top + height,
+                "label": classes[class_ids[i]],
+                "score": confidences[i],
+            }
+        )
+    return output_boxes
+
+
+def create_predictor():
+    """Create a predictor with CONFIG, without loading a model"""
+    predictor = YOLOv5Predictor.__new__(YOLOv5Predictor)
+    predictor.config = dict(CONFIG)
+    predictor.classes = [f"class_{i}" for i in range(NUM_CLASSES)]
+    return predictor
+
+
+def generate_outputs(rng):
+    """Return random network outputs, one (1, NUM_ROWS, 85) array"""
+    outputs = rng.random((1, NUM_ROWS, 5 + NUM_CLASSES), dtype=np.float32)
+    outputs[..., :2] *= CONFIG["input_width"]
+    outputs[..., 2:4] *= CONFIG["input_width"] / 4
+    # Most rows have a low objectness, as in real outputs, and about half
+    # of the others pass the class score threshold
+    outputs[..., 4] **= 8
+    outputs[..., 5:] *= 0.505
+    return (outputs,)
+
+
+def same_boxes(boxes, reference_boxes):
+    if len(boxes) != len(reference_boxes):
+        return False
+    for box, reference_box in zip(boxes, reference_boxes):
+        if box.keys() != reference_box.keys():
+            return False
+        for name, value in box.items():
+            if value != reference_box[name]:
+                return False
+    return True
+
+
+def main(args):
+    rng = np.random.default_rng(args.seed)
+    predictor = create_predictor()
+    image = np.zeros((args.image_height, args.image_width, 3), np.uint8)
+    num_failed = 0
+    times = []
+    reference_times = []
+    for run in range(args.runs):
+        outputs = generate_outputs(rng)
+
+        start = time.perf_counter()
+        boxes = predictor.post_process(image, outputs)
+        times.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        reference_boxes = reference_post_process(
+            predictor.config, predictor.classes, image, outputs
+        )
+        reference_times.append(time.perf_counter() - start)
+
+        if not same_boxes(boxes, reference_boxes):
+            num_failed += 1
+            print(
+                f"Run {run}: {len(boxes)} boxes, reference"
+                f" {len(reference_boxes)} boxes"
+            )
+
+    print(
+        f"{args.runs - num_failed}/{args.runs} runs match,"
+        f" post_process {np.mean(times) * 1000:.2f} ms,"
+        f" reference {np.mean(reference_times) * 1000:.2f} ms"
+    )
+    return 1 if num_failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        "Check YOLOv5 post-processing against the original per-row loop"
+    )
+    parser.add_argument(
+        "--runs", type=int, default=10, help="Number of random outputs"
+    )
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    parser.add_argument(
+        "--image_width", type=int, default=1280, help="Input image width"
+    )
+    parser.add_argument(
+        "--image_height", type=int, default=720, help="Input image height"
+    )
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,384 @@
+"""
+Per-stage latency benchmark of YOLOv5Predictor
+Runs a model over generated images at several resolutions and batch sizes and
+reports p50/p95/p99 latency of each stage plus overall throughput. Without
+--config, a tiny YOLOv5-shaped ONNX model with a dynamic batch size is
+generated (requires the onnx package), so nothing needs to be downloaded.
+Example:
+    python -m traincv.benchmarks.predictor --output results.json
+    python -m traincv.benchmarks.predictor --config model.yaml \
+        --resolution 640x480 --resolution 3840x2160 \
+        --batch_size 1 --batch_size 8 --output results.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+import yaml
+from PyQt5 import QtGui
+
+from traincv import __version__
+from traincv.services.yolov5 import YOLOv5Predictor
+from traincv.views.labeling.labelme.utils.opencv import qt_img_to_cv_img
+
+STAGES = ["qt_img_to_cv_img", "pre_process", "forward", "post_process", "nms"]
+# Tiny model: input size, number of classes, anchors per output cell and
+# strides of the output grids, as in YOLOv5 (25200 rows at 640x640)
+TINY_MODEL_INPUT_SIZE = 640
+TINY_MODEL_NUM_CLASSES = 80
+TINY_MODEL_ANCHORS = 3
+TINY_MODEL_STRIDES = (8, 16, 32)
+
+
+def parse_resolution(resolution):
+    width, height = resolution.lower().split("x")
+    return int(width), int(height)
+
+
+def build_tiny_model(model_path, seed=0):
+    """Write a tiny ONNX model with YOLOv5 input and output shapes
+
+    Each output grid is an average pooling of the input followed by a 1x1
+    convolution. A fixed random offset is added to the logits, so that
+    about 0.5% of the rows pass the default objectness threshold, as in
+    real outputs. The batch size is dynamic.
+    """
+    try:
+        # pylint: disable=import-outside-toplevel
+        import onnx
+        from onnx import TensorProto, helper, numpy_helper
+    except ImportError as e:
+        raise Exception(
+            "Generating the tiny model requires onnx. Install it with:"
+            " pip install onnx, or pass a model with --config"
+        ) from e
+
+    rng = np.random.default_rng(seed)
+    size = TINY_MODEL_INPUT_SIZE
+    row_size = 5 + TINY_MODEL_NUM_CLASSES
+    num_rows = sum(
+        TINY_MODEL_ANCHORS * (size // stride) ** 2
+        for stride in TINY_MODEL_STRIDES
+    )
+    nodes = []
+    initializers = []
+
+    def add_initializer(name, array):
+        initializers.append(numpy_helper.from_array(array, name))
+
+    grids = []
+    for stride in TINY_MODEL_STRIDES:
+        add_initializer(
+            f"weight_{stride}",
+            rng.normal(
+                0, 0.5, (TINY_MODEL_ANCHORS * row_size, 3, 1, 1)
+            ).astype(np.float32),
+        )
+        add_initializer(
+            f"bias_{stride}",
+            rng.normal(0, 0.5, TINY_MODEL_ANCHORS * row_size).astype(
+                np.float32
+            ),
+        )
+        # (N, anchors * row, H, W) -> (N, anchors * H * W, row)
+        add_initializer(
+            f"grid_shape_{stride}",
+            np.array([0, TINY_MODEL_ANCHORS, row_size, -1], np.int64),
+        )
+        add_initializer(
+            f"rows_shape_{stride}", np.array([0, -1, row_size], np.int64)
+        )
+        nodes += [
+            helper.make_node(
+                "AveragePool",
+                ["images"],
+                [f"pool_{stride}"],
+                kernel_shape=[stride, stride],
+                strides=[stride, stride],
+            ),
+            helper.make_node(
+                "Conv",
+                [f"pool_{stride}", f"weight_{stride}", f"bias_{stride}"],
+                [f"conv_{stride}"],
+            ),
+            helper.make_node(
+                "Reshape",
+                [f"conv_{stride}", f"grid_shape_{stride}"],
+                [f"grid_{stride}"],
+            ),
+            helper.make_node(
+                "Transpose",
+                [f"grid_{stride}"],
+                [f"transposed_{stride}"],
+                perm=[0, 1, 3, 2],
+            ),
+            helper.make_node(
+                "Reshape",
+                [f"transposed_{stride}", f"rows_shape_{stride}"],
+                [f"rows_{stride}"],
+            ),
+        ]
+        grids.append(f"rows_{stride}")
+
+    offset = rng.normal(0, 1, (1, num_rows, row_size)).astype(np.float32)
+    offset[..., 4] = offset[..., 4] * 1.5 - 4
+    add_initializer("offset", offset)
+    # Boxes in input pixels: (cx, cy) in [0, size], (w, h) in [0, size / 8]
+    scale = np.ones(row_size, np.float32)
+    scale[:4] = [size, size, size / 8, size / 8]
+    add_initializer("scale", scale)
+    nodes += [
+        helper.make_node("Concat", grids, ["concat"], axis=1),
+        helper.make_node("Add", ["concat", "offset"], ["logits"]),
+        helper.make_node("Sigmoid", ["logits"], ["scores"]),
+        helper.make_node("Mul", ["scores", "scale"], ["output"]),
+    ]
+    graph = helper.make_graph(
+        nodes,
+        "tiny_yolov5",
+        [
+            helper.make_tensor_value_info(
+                "images", TensorProto.FLOAT, ["batch", 3, size, size]
+            )
+        ],
+        [
+            helper.make_tensor_value_info(
+                "output", TensorProto.FLOAT, ["batch", num_rows, row_size]
+            )
+        ],
+        initializers,
+    )
+    model = helper.make_model(
+        graph, opset_imports=[helper.make_opsetid("", 12)]
+    )
+    # Readable by older ONNX Runtime and OpenCV versions
+    model.ir_version = 7
+    onnx.checker.check_model(model)
+    onnx.save(model, model_path)
+
+
+def create_tiny_config(folder_path):
+    """Write the tiny model and its config into a folder
+
+    Return the config path.
+    """
+    build_tiny_model(os.path.join(folder_path, "tiny_yolov5.onnx"))
+    config = {
+        "model_path": "tiny_yolov5.onnx",
+        "input_width": TINY_MODEL_INPUT_SIZE,
+        "input_height": TINY_MODEL_INPUT_SIZE,
+        "score_threshold": 0.5,
+        "nms_threshold": 0.45,
+        "confidence_threshold": 0.45,
+        "classes": [f"class_{i}" for i in range(TINY_MODEL_NUM_CLASSES)],
+    }
+    config_path = os.path.join(folder_path, "tiny_yolov5.yaml")
+    with open(config_path, "w") as f:
+        yaml.safe_dump(config, f)
+    return config_path
+
+
+def generate_qt_images(num_images, width, height, seed=42):
+    """Generate random RGB QImages"""
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(num_images):
+        array = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+        image = QtGui.QImage(
+            array.data, width, height, width * 3, QtGui.QImage.Format_RGB888
+        )
+        # Deep copy, so that the image does not depend on `array`
+        images.append(image.copy())
+    return images
+
+
+def summarize(latencies):
+    """Return latency statistics in milliseconds"""
+    latencies = np.array(latencies) * 1000
+    return {
+        "mean": float(latencies.mean()),
+        "p50": float(np.percentile(latencies, 50)),
+        "p95": float(np.percentile(latencies, 95)),
+        "p99": float(np.percentile(latencies, 99)),
+    }
+
+
+def run_batch(predictor, qt_images):
+    """Run one batch stage by stage and return stage durations (seconds)"""
+    durations = {}
+
+    start = time.perf_counter()
+    images = [qt_img_to_cv_img(image) for image in qt_images]
+    durations["qt_img_to_cv_img"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    blob = predictor.make_blob(images)
+    durations["pre_process"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    outputs = predictor.forward(predictor.net, blob)
+    durations["forward"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    filtered = []
+    for i, image in enumerate(images):
+        candidates = predictor.extract_candidates(outputs[0][i])
+        image_height, image_width = image.shape[:2]
+        filtered.append(
+            predictor.filter_candidates(candidates, image_width, image_height)
+        )
+    durations["post_process"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for boxes, confidences, class_ids in filtered:
+        predictor.nms_boxes(boxes, confidences, class_ids)
+    durations["nms"] = time.perf_counter() - start
+
+    return durations
+
+
+def benchmark(predictor, width, height, batch_size, num_batches, warmup):
+    """Benchmark one (resolution, batch size) setting"""
+    qt_images = generate_qt_images(batch_size, width, height)
+    for _ in range(warmup):
+        run_batch(predictor, qt_images)
+
+    stage_latencies = {stage: [] for stage in STAGES}
+    total_latencies = []
+    for _ in range(num_batches):
+        durations = run_batch(predictor, qt_images)
+        for stage in STAGES:
+            stage_latencies[stage].append(durations[stage])
+        total_latencies.append(sum(durations.values()))
+
+    return {
+        "resolution": f"{width}x{height}",
+        "batch_size": batch_size,
+        "num_batches": num_batches,
+        "stages": {
+            stage: summarize(latencies)
+            for stage, latencies in stage_latencies.items()
+        },
+        "total": summarize(total_latencies),
+        "throughput": batch_size * num_batches / sum(total_latencies),
+    }
+
+
+def benchmark_predictor(predictor, args):
+    """Benchmark all settings, return the list of results"""
+    results = []
+    for resolution in args.resolution or ["640x480", "1920x1080"]:
+        width, height = parse_resolution(resolution)
+        for batch_size in args.batch_size or [1]:
+            try:
+                result = benchmark(
+                    predictor,
+                    width,
+                    height,
+                    batch_size,
+                    args.num_batches,
+                    args.warmup,
+                )
+            except Exception as e:  # pylint: disable=broad-except
+                # E.g. models exported with a fixed batch size
+                print(f"{resolution} batch {batch_size}: failed ({e})")
+                continue
+            result["backend"] = predictor.backend_name
+            results.append(result)
+
+            print(
+                f"{predictor.backend_name} {result['resolution']}"
+                f" batch {batch_size}: {result['throughput']:.2f} images/s"
+            )
+            for stage in STAGES + ["total"]:
+                stats = (
+                    result["total"]
+                    if stage == "total"
+                    else result["stages"][stage]
+                )
+                print(
+                    f"  {stage:<18} p50 {stats['p50']:9.3f} ms"
+                    f"  p95 {stats['p95']:9.3f} ms"
+                    f"  p99 {stats['p99']:9.3f} ms"
+                )
+    return results
+
+
+def main(args):
+    report = {
+        "traincv_version": __version__,
+        "opencv_version": cv2.__version__,
+        "python_version": platform.python_version(),
+        "machine": platform.machine(),
+        "config": args.config or "tiny synthetic model",
+        "results": [],
+    }
+    with tempfile.TemporaryDirectory() as tmp_path:
+        config_path = args.config
+        # Backend of the config, or both backends on the tiny model
+        backends = args.backend or [None]
+        if config_path is None:
+            config_path = create_tiny_config(tmp_path)
+            backends = args.backend or ["opencv", "onnxruntime"]
+
+        for backend in backends:
+            predictor = YOLOv5Predictor(
+                config_path,
+                config_overrides={"backend": backend} if backend else None,
+            )
+            predictor.warm_up()
+            report["results"] += benchmark_predictor(predictor, args)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        "Per-stage latency benchmark of YOLOv5Predictor"
+    )
+    parser.add_argument(
+        "--config",
+        type=str,
+        required=False,
+        help="Model config file (yaml). Default: generated tiny model",
+    )
+    parser.add_argument(
+        "--backend",
+        action="append",
+        help="Backend to benchmark. Default: backend of the config, or"
+        " opencv and onnxruntime with the tiny model",
+    )
+    parser.add_argument(
+        "--resolution",
+        action="append",
+        help="Image resolution WIDTHxHEIGHT. Default: 640x480, 1920x1080",
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        action="append",
+        help="Batch size. Default: 1",
+    )
+    parser.add_argument(
+        "--num_batches",
+        type=int,
+        default=50,
+        help="Number of measured batches per setting",
+    )
+    parser.add_argument(
+        "--warmup", type=int, default=3, help="Number of warm-up batches"
+    )
+    parser.add_argument(
+        "--output", type=str, required=False, help="Output JSON file"
+    )
+    sys.exit(main(parser.parse_args()))
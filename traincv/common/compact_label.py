@@ -0,0 +1,142 @@
+"""
+Compact binary label files
+A compact label file holds the same data as a labelme JSON file, with the
+points of all shapes in one float32 array and the image data as raw bytes
+instead of base64. Files are smaller and are parsed without building a list
+per point.
+
+Layout (little-endian):
+    header: magic "TCVL", format version (uint32), sizes of the metadata,
+        points and image data sections (3 x uint64)
+    metadata: UTF-8 JSON of the labelme data, without image data. The
+        "points" of each shape hold their number of points.
+    points: float32 array (total number of points, 2)
+    image data: raw bytes of the embedded image, if any
+"""
+
+import base64
+import json
+import struct
+
+import numpy as np
+
+COMPACT_LABEL_SUFFIX = ".label"
+COMPACT_LABEL_MAGIC = b"TCVL"
+COMPACT_LABEL_VERSION = 1
+HEADER = struct.Struct("<4sIQQQ")
+# float32 keeps about 7 significant digits. Points are rounded when they
+# are converted back to Python floats, so that 12.3 does not become
+# 12.300000190734863.
+POINT_DECIMALS = 4
+
+
+class CompactLabelError(Exception):
+    pass
+
+
+def encode_compact_label(data):
+    """Encode labelme data into compact label file contents
+
+    "imageData" may be raw bytes or a base64 string, as in labelme JSON.
+    """
+    image_data = data.get("imageData")
+    if isinstance(image_data, str):
+        image_data = base64.b64decode(image_data)
+    image_data = image_data or b""
+
+    meta = dict(data)
+    meta["imageData"] = None
+    meta["shapes"] = []
+    points = []
+    for shape in data.get("shapes", []):
+        shape = dict(shape)
+        shape_points = shape.get("points") or []
+        shape["points"] = len(shape_points)
+        points.extend(shape_points)
+        meta["shapes"].append(shape)
+    meta_data = json.dumps(
+        meta, ensure_ascii=False, separators=(",", ":")
+    ).encode("utf-8")
+    points_data = (
+        np.asarray(points, dtype="<f4").reshape(-1, 2).tobytes()
+        if points
+        else b""
+    )
+    header = HEADER.pack(
+        COMPACT_LABEL_MAGIC,
+        COMPACT_LABEL_VERSION,
+        len(meta_data),
+        len(points_data),
+        len(image_data),
+    )
+    return b"".join((header, meta_data, points_data, image_data))
+
+
+def write_compact_label(path, data):
+    with open(path, "wb") as f:
+        f.write(encode_compact_label(data))
+
+
+def read_compact_label(path, read_image_data=True):
+    """Read a compact label file
+
+    Return (data, image_location): data is the labelme data, with raw
+    image bytes as "imageData", and image_location is (offset, size) of
+    the embedded image, or None. Without `read_image_data`, "imageData" is
+    None and the image can be read later with read_compact_image_data.
+    """
+    with open(path, "rb") as f:
+        header = f.read(HEADER.size)
+        if len(header) != HEADER.size:
+            raise CompactLabelError(f"Truncated compact label file: {path}")
+        magic, version, meta_size, points_size, image_size = HEADER.unpack(
+            header
+        )
+        if magic != COMPACT_LABEL_MAGIC:
+            raise CompactLabelError(f"Not a compact label file: {path}")
+        if version != COMPACT_LABEL_VERSION:
+            raise CompactLabelError(
+                f"Unsupported compact label version {version}: {path}"
+            )
+        body = f.read(meta_size + points_size)
+        if len(body) != meta_size + points_size:
+            raise CompactLabelError(f"Truncated compact label file: {path}")
+        image_data = None
+        if read_image_data and image_size > 0:
+            image_data = f.read(image_size)
+
+    data = json.loads(body[:meta_size].decode("utf-8"))
+    points = (
+        np.frombuffer(body, dtype="<f4", offset=meta_size)
+        .reshape(-1, 2)
+        .astype(np.float64)
+        .round(POINT_DECIMALS)
+        .tolist()
+    )
+    start = 0
+    for shape in data.get("shapes", []):
+        end = start + shape["points"]
+        shape["points"] = points[start:end]
+        start = end
+    if start != len(points):
+        raise CompactLabelError(f"Invalid number of points: {path}")
+    data["imageData"] = image_data
+
+    image_location = None
+    if image_size > 0:
+        image_location = (HEADER.size + meta_size + points_size, image_size)
+    return data, image_location
+
+
+def read_compact_image_data(path, offset, size):
+    """Read the embedded image of a compact label file"""
+    with open(path, "rb") as f:
+        f.seek(offset)
+        image_data = f.read(size)
+    if len(image_data) != size:
+        raise CompactLabelError(f"Truncated compact label file: {path}")
+    return image_data
+
+
+def is_compact_label_file(path):
+    return path.lower().endswith(COMPACT_LABEL_SUFFIX)
@@ -0,0 +1,139 @@
+"""
+Single-pass scanner of image / label folders
+Folders are listed with os.scandir, which returns file types together with
+names, so no file is stat-ed on most filesystems. Images and labels are paired
+by file stem while each folder is listed, and results are yielded folder by
+folder, so callers can start using them before the whole tree is scanned.
+"""
+
+import collections
+import os
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff")
+LABEL_EXTENSION = ".json"
+
+ScanResult = collections.namedtuple("ScanResult", ["image_path", "label_path"])
+ScanResult.__doc__ = """An image and its label file (None if not labeled)"""
+
+
+def scan_dataset(
+    root_path,
+    image_extensions=IMAGE_EXTENSIONS,
+    label_extension=LABEL_EXTENSION,
+    sort_key=None,
+):
+    """Yield a ScanResult for each image under root_path
+
+    Labels are files next to their images with the same stem and
+    `label_extension`, which may also be a tuple of extensions, earlier
+    ones first when an image has several label files. Entries of each
+    folder are sorted by name with `sort_key`, and sub-folders are scanned
+    in place, so results come in the order of sorted paths. Symlinks to
+    folders are not followed, like os.walk.
+    """
+    image_extensions = tuple(ext.lower() for ext in image_extensions)
+    if isinstance(label_extension, str):
+        label_extension = (label_extension,)
+    label_extensions = tuple(ext.lower() for ext in label_extension)
+    if sort_key is None:
+        sort_key = str
+
+    def listing(folder_path):
+        return iter(
+            list_folder(
+                folder_path, image_extensions, label_extensions, sort_key
+            )
+        )
+
+    # Depth-first traversal with a stack of folder listings
+    stack = [listing(root_path)]
+    while stack:
+        item = next(stack[-1], None)
+        if item is None:
+            stack.pop()
+        elif isinstance(item, ScanResult):
+            yield item
+        else:
+            stack.append(listing(item))
+
+
+def list_folder(folder_path, image_extensions, label_extensions, sort_key):
+    """List a folder with a single os.scandir call
+
+    Return sub-folder paths and ScanResults of images, sorted by name.
+    """
+    folders = []
+    images = []
+    # Stem -> (index of the extension in label_extensions, label path)
+    labels = {}
+    try:
+        with os.scandir(folder_path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir():
+                        if not entry.is_symlink():
+                            folders.append(entry)
+                        continue
+                    if not entry.is_file():
+                        continue
+                except OSError:
+                    continue
+                stem, ext = os.path.splitext(entry.name)
+                ext = ext.lower()
+                if ext in image_extensions:
+                    images.append(entry)
+                elif ext in label_extensions:
+                    label = (label_extensions.index(ext), entry.path)
+                    labels[stem] = min(labels.get(stem, label), label)
+    except OSError:
+        return []
+
+    items = [(sort_key(entry.name), entry.path) for entry in folders]
+    for entry in images:
+        stem = os.path.splitext(entry.name)[0]
+        label_path = labels[stem][1] if stem in labels else None
+        items.append(
+            (sort_key(entry.name), ScanResult(entry.path, label_path))
+        )
+    items.sort(key=lambda item: item[0])
+    return [item for _, item in items]
+
+
+def scan_files(root_path, extension):
+    """Yield os.DirEntry of files with an extension under root_path
+
+    Entries cache their stat results, so callers which need them pay one
+    stat per yielded file only.
+    """
+    extension = extension.lower()
+    folders = [root_path]
+    while folders:
+        try:
+            with os.scandir(folders.pop()) as it:
+                for entry in it:
+                    try:
+                        if entry.is_dir():
+                            if not entry.is_symlink():
+                                folders.append(entry.path)
+                        elif entry.name.lower().endswith(extension):
+                            yield entry
+                    except OSError:
+                        continue
+        except OSError:
+            continue
+
+
+def list_file_names(folder_path, extension=None):
+    """Return the set of file names in a folder with one directory listing
+
+    `extension` may also be a tuple of extensions.
+    """
+    names = set()
+    try:
+        with os.scandir(folder_path) as it:
+            for entry in it:
+                if extension is None or entry.name.lower().endswith(extension):
+                    names.add(entry.name)
+    except OSError:
+        pass
+    return names
@@ -0,0 +1,262 @@
+"""
+Read image metadata from file headers without decoding pixels
+Width, height, channels and EXIF orientation are parsed from JPEG, PNG, BMP,
+TIFF and WebP headers. Other formats fall back to PIL, which also only reads
+the header until pixels are requested.
+"""
+
+import collections
+import io
+import struct
+
+import PIL.Image
+
+# Orientation tag in TIFF / EXIF IFDs
+EXIF_ORIENTATION_TAG = 0x0112
+TIFF_WIDTH_TAG = 0x0100
+TIFF_HEIGHT_TAG = 0x0101
+TIFF_SAMPLES_PER_PIXEL_TAG = 0x0115
+
+# Number of channels of each PNG color type
+PNG_COLOR_TYPE_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+# JPEG start of frame markers (excluding DHT, JPG and DAC)
+JPEG_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+# JPEG markers without a length field
+JPEG_STANDALONE_MARKERS = set(range(0xD0, 0xD8)) | {0x01, 0xD8}
+
+ImageMetadata = collections.namedtuple(
+    "ImageMetadata", ["format", "width", "height", "channels", "orientation"]
+)
+ImageMetadata.__doc__ = """Image metadata as stored in the file
+
+width and height are the stored size, before applying the EXIF orientation.
+channels is the number of samples stored per pixel (1 for palette images).
+"""
+
+
+class ImageMetadataError(Exception):
+    pass
+
+
+def read_image_metadata(source):
+    """Read metadata of an image file path, bytes or binary file object"""
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return read_image_metadata_from_file(io.BytesIO(source))
+    if hasattr(source, "read"):
+        return read_image_metadata_from_file(source)
+    try:
+        with open(source, "rb") as f:
+            return read_image_metadata_from_file(f)
+    except OSError as e:
+        raise ImageMetadataError(f"Could not read image: {e}") from e
+
+
+def read_image_metadata_from_file(f):
+    start = f.tell()
+    signature = f.read(16)
+    f.seek(start)
+    readers = [
+        (b"\xff\xd8", read_jpeg_metadata),
+        (b"\x89PNG\r\n\x1a\n", read_png_metadata),
+        (b"BM", read_bmp_metadata),
+        (b"II*\x00", read_tiff_metadata),
+        (b"MM\x00*", read_tiff_metadata),
+    ]
+    try:
+        for magic, reader in readers:
+            if signature.startswith(magic):
+                return reader(f)
+        if signature[:4] == b"RIFF" and signature[8:12] == b"WEBP":
+            return read_webp_metadata(f)
+    except (struct.error, ValueError) as e:
+        raise ImageMetadataError(f"Corrupted image header: {e}") from e
+    return read_pil_metadata(f)
+
+
+def read_exact(f, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise ImageMetadataError("Unexpected end of image header")
+    return data
+
+
+def read_tiff_tags(f, tags):
+    """Read SHORT / LONG values of IFD0 tags of a TIFF stream at f.tell()"""
+    base = f.tell()
+    byte_order = read_exact(f, 2)
+    if byte_order == b"II":
+        endian = "<"
+    elif byte_order == b"MM":
+        endian = ">"
+    else:
+        raise ImageMetadataError("Invalid TIFF byte order")
+    magic, ifd_offset = struct.unpack(endian + "HI", read_exact(f, 6))
+    if magic != 42:
+        raise ImageMetadataError("Invalid TIFF header")
+
+    f.seek(base + ifd_offset)
+    (num_entries,) = struct.unpack(endian + "H", read_exact(f, 2))
+    values = {}
+    for _ in range(num_entries):
+        tag, value_type, _, value = struct.unpack(
+            endian + "HHI4s", read_exact(f, 12)
+        )
+        if tag not in tags:
+            continue
+        if value_type == 3:  # SHORT
+            values[tag] = struct.unpack(endian + "H", value[:2])[0]
+        elif value_type == 4:  # LONG
+            values[tag] = struct.unpack(endian + "I", value)[0]
+    return values
+
+
+def read_exif_orientation(exif_data):
+    """Read orientation from EXIF data, with or without the Exif header"""
+    if exif_data.startswith(b"Exif\x00\x00"):
+        exif_data = exif_data[6:]
+    try:
+        tags = read_tiff_tags(io.BytesIO(exif_data), {EXIF_ORIENTATION_TAG})
+    except (ImageMetadataError, struct.error):
+        return 1
+    return tags.get(EXIF_ORIENTATION_TAG, 1)
+
+
+def read_jpeg_metadata(f):
+    read_exact(f, 2)  # SOI
+    orientation = 1
+    while True:
+        byte = read_exact(f, 1)
+        if byte != b"\xff":
+            continue
+        marker = read_exact(f, 1)[0]
+        while marker == 0xFF:  # Fill bytes
+            marker = read_exact(f, 1)[0]
+        if marker in JPEG_STANDALONE_MARKERS:
+            continue
+        if marker == 0xDA:  # Start of scan: no frame header found
+            raise ImageMetadataError("JPEG frame header not found")
+
+        (length,) = struct.unpack(">H", read_exact(f, 2))
+        if marker in JPEG_SOF_MARKERS:
+            _, height, width, channels = struct.unpack(
+                ">BHHB", read_exact(f, 6)
+            )
+            return ImageMetadata("JPEG", width, height, channels, orientation)
+        if marker == 0xE1:  # APP1
+            segment = read_exact(f, length - 2)
+            if segment.startswith(b"Exif\x00\x00"):
+                orientation = read_exif_orientation(segment)
+        else:
+            f.seek(length - 2, io.SEEK_CUR)
+
+
+def read_png_metadata(f):
+    read_exact(f, 8)  # Signature
+    length, chunk_type = struct.unpack(">I4s", read_exact(f, 8))
+    if chunk_type != b"IHDR":
+        raise ImageMetadataError("PNG header not found")
+    width, height, _, color_type = struct.unpack(">IIBB", read_exact(f, 10))
+    channels = PNG_COLOR_TYPE_CHANNELS.get(color_type, 3)
+    f.seek(length - 10 + 4, io.SEEK_CUR)  # Rest of IHDR and CRC
+
+    # EXIF data, if any, is stored before the pixel data
+    orientation = 1
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            break
+        length, chunk_type = struct.unpack(">I4s", header)
+        if chunk_type in (b"IDAT", b"IEND"):
+            break
+        if chunk_type == b"eXIf":
+            orientation = read_exif_orientation(read_exact(f, length))
+            break
+        f.seek(length + 4, io.SEEK_CUR)
+    return ImageMetadata("PNG", width, height, channels, orientation)
+
+
+def read_bmp_metadata(f):
+    read_exact(f, 14)  # File header
+    (header_size,) = struct.unpack("<I", read_exact(f, 4))
+    if header_size == 12:  # BITMAPCOREHEADER
+        width, height, _, bits = struct.unpack("<HHHH", read_exact(f, 8))
+    else:
+        width, height, _, bits = struct.unpack("<iiHH", read_exact(f, 12))
+    if bits <= 8:  # Palette
+        channels = 1
+    else:
+        channels = 4 if bits == 32 else 3
+    # Negative height: rows are stored top-down
+    return ImageMetadata("BMP", width, abs(height), channels, 1)
+
+
+def read_tiff_metadata(f):
+    tags = read_tiff_tags(
+        f,
+        {
+            TIFF_WIDTH_TAG,
+            TIFF_HEIGHT_TAG,
+            TIFF_SAMPLES_PER_PIXEL_TAG,
+            EXIF_ORIENTATION_TAG,
+        },
+    )
+    if TIFF_WIDTH_TAG not in tags or TIFF_HEIGHT_TAG not in tags:
+        raise ImageMetadataError("TIFF image size not found")
+    return ImageMetadata(
+        "TIFF",
+        tags[TIFF_WIDTH_TAG],
+        tags[TIFF_HEIGHT_TAG],
+        tags.get(TIFF_SAMPLES_PER_PIXEL_TAG, 1),
+        tags.get(EXIF_ORIENTATION_TAG, 1),
+    )
+
+
+def read_webp_metadata(f):
+    read_exact(f, 12)  # RIFF header
+    chunk_type, length = struct.unpack("<4sI", read_exact(f, 8))
+    data = read_exact(f, min(length, 30))
+    if chunk_type == b"VP8 ":
+        # Frame tag (3 bytes) and start code (3 bytes) come first
+        width, height = struct.unpack("<HH", data[6:10])
+        return ImageMetadata("WEBP", width & 0x3FFF, height & 0x3FFF, 3, 1)
+    if chunk_type == b"VP8L":
+        (bits,) = struct.unpack("<I", data[1:5])
+        width = (bits & 0x3FFF) + 1
+        height = ((bits >> 14) & 0x3FFF) + 1
+        channels = 4 if (bits >> 28) & 1 else 3
+        return ImageMetadata("WEBP", width, height, channels, 1)
+    if chunk_type != b"VP8X":
+        raise ImageMetadataError("WebP header not found")
+
+    flags = data[0]
+    width = int.from_bytes(data[4:7], "little") + 1
+    height = int.from_bytes(data[7:10], "little") + 1
+    channels = 4 if flags & 0x10 else 3
+    orientation = 1
+    if flags & 0x08:  # Has EXIF chunk
+        f.seek(length + (length & 1) - len(data), io.SEEK_CUR)
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                break
+            chunk_type, length = struct.unpack("<4sI", header)
+            if chunk_type == b"EXIF":
+                orientation = read_exif_orientation(read_exact(f, length))
+                break
+            f.seek(length + (length & 1), io.SEEK_CUR)
+    return ImageMetadata("WEBP", width, height, channels, orientation)
+
+
+def read_pil_metadata(f):
+    try:
+        with PIL.Image.open(f) as image:
+            orientation = image.getexif().get(EXIF_ORIENTATION_TAG, 1)
+            return ImageMetadata(
+                image.format,
+                image.width,
+                image.height,
+                len(image.getbands()),
+                orientation,
+            )
+    except (OSError, SyntaxError, ValueError) as e:
+        raise ImageMetadataError(f"Unsupported image: {e}") from e
@@ -50,6 +50,15 @@ class TableModel(QAbstractTableModel):
         self.table_changed.emit(self._data)
         self.modelReset.emit()
 
+    def updateRow(self, row: int, values: dict):
+        """Update cells of a row"""
+        for column, value in values.items():
+            self._data.at[self._data.index[row], column] = value
+        self.table_changed.emit(self._data)
+        self.dataChanged.emit(
+            self.index(row, 0), self.index(row, self.columnCount(None) - 1)
+        )
+
     def removeRow(self, row: int) -> bool:
         """Remove a row from table"""
         self._data.drop(self._data.index[row], inplace=True)
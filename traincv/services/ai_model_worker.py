@@ -0,0 +1,206 @@
+"""
+Background worker for AI models used in labeling
+Model loading, warm-up and prediction run on a separate thread so that the
+labeling window stays responsive. Predictions of upcoming images can be
+prefetched while the annotator works on the current one.
+"""
+
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from PyQt5.QtCore import (QCoreApplication, QObject, Qt, QThread,
+                          pyqtSignal, pyqtSlot)
+from PyQt5.QtGui import QImage
+
+from traincv.services.yolov5 import YOLOv5Predictor
+from traincv.views.labeling.labelme.label_file import LabelFile
+
+PREDICTION_CACHE_SIZE = 32
+
+
+class PredictionCache:
+    """Thread-safe LRU cache of predicted shapes
+
+    Keys are (image path, image mtime), so edited images are predicted
+    again. Copies of the shapes are returned, so that editing them on the
+    canvas does not change the cache.
+    """
+
+    def __init__(self, max_items=PREDICTION_CACHE_SIZE):
+        self.max_items = max_items
+        self.items = OrderedDict()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(filename):
+        try:
+            return filename, os.path.getmtime(filename)
+        except OSError:
+            return None
+
+    def get(self, key):
+        if key is None:
+            return None
+        with self.lock:
+            if key not in self.items:
+                return None
+            self.items.move_to_end(key)
+            shapes = self.items[key]
+        return [shape.copy() for shape in shapes]
+
+    def put(self, key, shapes):
+        if key is None:
+            return
+        shapes = [shape.copy() for shape in shapes]
+        with self.lock:
+            self.items[key] = shapes
+            self.items.move_to_end(key)
+            while len(self.items) > self.max_items:
+                self.items.popitem(last=False)
+
+    def contains(self, key):
+        with self.lock:
+            return key in self.items
+
+    def clear(self):
+        with self.lock:
+            self.items.clear()
+
+
+class AIModelWorker(QObject):
+    """Load a model and predict shapes outside of the GUI thread
+
+    Every request carries an increasing id. Queued requests whose id is not
+    newer than the last cancelled id are skipped, and the results of a
+    cancelled request are never emitted.
+
+    Prefetching handles one image per event loop iteration, so requests for
+    the current image wait for at most one prefetch prediction.
+    """
+
+    load_requested = pyqtSignal(int, str)
+    predict_requested = pyqtSignal(int, str, QImage)
+    prefetch_requested = pyqtSignal()
+
+    progress = pyqtSignal(int, str)
+    model_loaded = pyqtSignal(int, str)
+    shapes_predicted = pyqtSignal(int, str, list)
+    failed = pyqtSignal(int, str)
+
+    def __init__(self):
+        super().__init__()
+        self.model = None
+        self.cancelled_id = -1
+        self.predictions = PredictionCache()
+        self.prefetch_paths = []
+        self.prefetch_lock = threading.Lock()
+        self.worker_thread = QThread()
+        self.moveToThread(self.worker_thread)
+        self.load_requested.connect(self.load_model)
+        self.predict_requested.connect(self.predict)
+        # Always queued, so that prefetching yields to pending requests
+        self.prefetch_requested.connect(
+            self.prefetch_next, Qt.QueuedConnection
+        )
+        app = QCoreApplication.instance()
+        if app is not None:
+            # Direct connection: stop() must run in the GUI thread
+            app.aboutToQuit.connect(self.stop, Qt.DirectConnection)
+        self.worker_thread.start()
+
+    def cancel(self, request_id):
+        """Cancel a request and all requests before it"""
+        self.cancelled_id = max(self.cancelled_id, request_id)
+
+    def is_cancelled(self, request_id):
+        return request_id <= self.cancelled_id
+
+    def set_prefetch_paths(self, paths):
+        """Replace the list of images to prefetch predictions for"""
+        with self.prefetch_lock:
+            self.prefetch_paths = list(paths)
+        self.prefetch_requested.emit()
+
+    def get_cached_shapes(self, filename):
+        """Return predicted shapes of an image if they are cached"""
+        return self.predictions.get(PredictionCache.key(filename))
+
+    def stop(self):
+        self.worker_thread.quit()
+        self.worker_thread.wait()
+
+    @pyqtSlot(int, str)
+    def load_model(self, request_id, config_path):
+        if self.is_cancelled(request_id):
+            return
+        self.progress.emit(request_id, "Loading AI model...")
+        try:
+            model = YOLOv5Predictor(config_path)
+            if self.is_cancelled(request_id):
+                return
+            self.progress.emit(request_id, "Warming up AI model...")
+            model.warm_up()
+        except Exception as e:  # pylint: disable=broad-except
+            self.failed.emit(request_id, f"Failed to load AI model: {e}")
+            return
+        if self.is_cancelled(request_id):
+            return
+        self.model = model
+        self.predictions.clear()
+        self.model_loaded.emit(request_id, config_path)
+        self.prefetch_requested.emit()
+
+    @pyqtSlot(int, str, QImage)
+    def predict(self, request_id, filename, image):
+        if self.is_cancelled(request_id):
+            return
+        if self.model is None:
+            self.failed.emit(request_id, "No AI model is loaded.")
+            return
+        self.progress.emit(request_id, "Predicting shapes...")
+        key = PredictionCache.key(filename)
+        try:
+            shapes = self.predictions.get(key)
+            if shapes is None:
+                shapes = self.model.predict_shapes(image)
+                self.predictions.put(key, shapes)
+        except Exception as e:  # pylint: disable=broad-except
+            self.failed.emit(request_id, f"Failed to predict shapes: {e}")
+            return
+        if self.is_cancelled(request_id):
+            return
+        self.shapes_predicted.emit(request_id, filename, shapes)
+
+    @pyqtSlot()
+    def prefetch_next(self):
+        """Predict the next image in the prefetch list"""
+        if self.model is None:
+            return
+
+        filename = key = None
+        with self.prefetch_lock:
+            while self.prefetch_paths:
+                candidate = self.prefetch_paths.pop(0)
+                candidate_key = PredictionCache.key(candidate)
+                if candidate_key and not self.predictions.contains(
+                    candidate_key
+                ):
+                    filename, key = candidate, candidate_key
+                    break
+        if filename is None:
+            return
+
+        image_data = LabelFile.load_image_file(filename)
+        image = QImage.fromData(image_data) if image_data else QImage()
+        if image.isNull():
+            logging.warning("Could not prefetch predictions: %s", filename)
+        else:
+            try:
+                self.predictions.put(key, self.model.predict_shapes(image))
+            except Exception as e:  # pylint: disable=broad-except
+                logging.warning("Could not prefetch predictions: %s", e)
+
+        # Continue after requests which are already queued
+        self.prefetch_requested.emit()
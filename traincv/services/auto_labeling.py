@@ -0,0 +1,235 @@
+"""
+Headless auto-labeling for whole image folders
+Images are spread across a process pool. Each worker loads the model once and
+writes one labelme JSON file per image. Images which already have a label file
+are skipped, so an interrupted job can be resumed by running it again.
+Within a worker, images are read and saved by `batch_size` threads, and their
+predictions are collected into batched forward passes by a DynamicBatcher.
+"""
+
+import argparse
+import functools
+import logging
+import multiprocessing
+import os
+import os.path as osp
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+from traincv.common.dataset_scanner import list_file_names, scan_dataset
+from traincv.services.dynamic_batcher import DynamicBatcher
+from traincv.services.yolov5 import YOLOv5Predictor
+from traincv.views.labeling.labelme.label_file import LabelFile
+
+# Predictor and batcher of the current worker process
+worker_predictor = None
+worker_batcher = None
+
+
+def get_label_path(image_path, output_dir=None, images_path=None):
+    """Return the labelme JSON path for an image
+
+    With `output_dir`, the path of the image relative to `images_path` is
+    kept, so that images with the same name in different sub-folders get
+    different label files.
+    """
+    label_path = osp.splitext(image_path)[0] + LabelFile.suffix
+    if output_dir:
+        label_path = osp.join(
+            output_dir, osp.relpath(label_path, images_path or ".")
+        )
+    return label_path
+
+
+def boxes_to_label_shapes(boxes):
+    """Convert predicted boxes to labelme shape dicts"""
+    shapes = []
+    for box in boxes:
+        shapes.append(
+            dict(
+                label=box["label"],
+                text="",
+                points=[
+                    [float(box["x1"]), float(box["y1"])],
+                    [float(box["x2"]), float(box["y2"])],
+                ],
+                group_id=None,
+                shape_type="rectangle",
+                flags={},
+            )
+        )
+    return shapes
+
+
+def init_worker(config_path, num_threads, batch_size=1):
+    """Load the predictor once per worker process"""
+    # pylint: disable=global-statement
+    global worker_predictor, worker_batcher
+    cv2.setNumThreads(num_threads)
+    worker_predictor = YOLOv5Predictor(config_path)
+    predict_batch = functools.partial(
+        worker_predictor.predict_batch, max_batch=batch_size
+    )
+    worker_batcher = DynamicBatcher(predict_batch, max_batch=batch_size)
+
+
+def label_image(task):
+    """Predict and save labels of one image
+
+    Return (image_path, error), error is None on success.
+    """
+    image_path, label_path = task
+    try:
+        image = cv2.imread(image_path)
+        if image is None:
+            return image_path, "Could not read image"
+        boxes = worker_batcher.predict(image)
+
+        # LabelFile.save replaces the file only when it is completely
+        # written, so a crash never leaves a partial label file, which
+        # would be skipped on resume
+        os.makedirs(osp.dirname(label_path) or ".", exist_ok=True)
+        LabelFile().save(
+            filename=label_path,
+            shapes=boxes_to_label_shapes(boxes),
+            image_path=osp.relpath(image_path, osp.dirname(label_path)),
+            image_height=image.shape[0],
+            image_width=image.shape[1],
+        )
+    except Exception as e:  # pylint: disable=broad-except
+        return image_path, str(e)
+    return image_path, None
+
+
+def label_images(tasks):
+    """Label a chunk of images, return a list of (image_path, error)
+
+    One thread per batch slot, so that the batcher can fill its batches.
+    """
+    with ThreadPoolExecutor(max_workers=worker_batcher.max_batch) as executor:
+        return list(executor.map(label_image, tasks))
+
+
+def list_pending_images(images_path, output_dir=None, overwrite=False):
+    """List (image_path, label_path) of images which need labels"""
+    # Existing labels are found with one listing per output folder,
+    # without a stat per image: folder -> label file names
+    existing_labels = {}
+    tasks = []
+    for image_path, label_path in scan_dataset(images_path):
+        if output_dir:
+            label_path = get_label_path(image_path, output_dir, images_path)
+            label_folder = osp.dirname(label_path)
+            if label_folder not in existing_labels:
+                existing_labels[label_folder] = list_file_names(
+                    label_folder, LabelFile.suffix
+                )
+            labeled = osp.basename(label_path) in existing_labels[label_folder]
+        else:
+            labeled = label_path is not None
+            label_path = get_label_path(image_path)
+        if labeled and not overwrite:
+            continue
+        tasks.append((image_path, label_path))
+    return tasks
+
+
+def main(args):
+    if not osp.isfile(args.config):
+        raise Exception(f"Config file not found: {args.config}")
+    if not osp.isdir(args.images):
+        raise Exception(f"Image folder not found: {args.images}")
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    tasks = list_pending_images(args.images, args.output_dir, args.overwrite)
+    if len(tasks) == 0:
+        logging.info("All images are already labeled")
+        return 0
+    logging.info("Labeling %d images", len(tasks))
+
+    num_workers = args.workers or os.cpu_count() or 1
+    chunks = [
+        tasks[start : start + args.chunk_size]
+        for start in range(0, len(tasks), args.chunk_size)
+    ]
+    num_done = 0
+    num_failed = 0
+    next_report = 100
+    with multiprocessing.Pool(
+        processes=num_workers,
+        initializer=init_worker,
+        initargs=(args.config, args.threads_per_worker, args.batch_size),
+    ) as pool:
+        for results in pool.imap_unordered(label_images, chunks):
+            for image_path, error in results:
+                if error is not None:
+                    num_failed += 1
+                    logging.warning(
+                        "Failed to label %s: %s", image_path, error
+                    )
+            num_done += len(results)
+            if num_done >= next_report or num_done == len(tasks):
+                logging.info("%d / %d", num_done, len(tasks))
+                next_report = (num_done // 100 + 1) * 100
+
+    logging.info("Labeled: %d", len(tasks) - num_failed)
+    logging.info("Failed: %d", num_failed)
+    return 1 if num_failed > 0 else 0
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(
+        "Auto-label an image folder with a YOLOv5 model"
+    )
+    parser.add_argument(
+        "--config", type=str, required=True, help="Model config file (yaml)"
+    )
+    parser.add_argument(
+        "--images", type=str, required=True, help="Image folder"
+    )
+    parser.add_argument(
+        "--output_dir",
+        type=str,
+        required=False,
+        help="Output folder for label files. Default: next to images",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of worker processes. Default: number of CPUs",
+    )
+    parser.add_argument(
+        "--threads_per_worker",
+        type=int,
+        default=1,
+        help="Number of OpenCV threads in each worker",
+    )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=1,
+        help="Number of images per forward pass in each worker. Values"
+        " above 1 need a model exported with a dynamic batch size",
+    )
+    parser.add_argument(
+        "--chunk_size",
+        type=int,
+        default=16,
+        help="Number of images sent to a worker at once",
+    )
+    parser.add_argument(
+        "--overwrite",
+        action="store_true",
+        help="Re-label images which already have a label file",
+    )
+    return parser
+
+
+if __name__ == "__main__":
+    logging.getLogger().setLevel(logging.INFO)
+    parsed_args = build_arg_parser().parse_args()
+    sys.exit(main(parsed_args))
@@ -0,0 +1,138 @@
+"""
+Cache of raw detection candidates
+Candidates are stored before thresholding and NMS, so that changing a
+threshold only needs to re-filter cached arrays instead of running the network.
+"""
+
+import hashlib
+import logging
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+
+def hash_bytes(data):
+    """Return a short content hash of a bytes-like object"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+
+def hash_file(path, chunk_size=1 << 20):
+    """Return a short content hash of a file"""
+    hasher = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def hash_image(image):
+    """Return a content hash of an image array, including its shape"""
+    image = np.ascontiguousarray(image)
+    shape = "x".join(str(dim) for dim in image.shape)
+    return f"{shape}-{hash_bytes(image.data)}"
+
+
+class CandidateCache:
+    """LRU cache of candidate arrays with an optional on-disk tier
+
+    Up to `max_items` arrays are kept in memory. When `cache_dir` is set,
+    every array is also saved there and is reloaded on memory misses.
+    Files of the on-disk tier are kept under `max_disk_bytes` in total,
+    least recently used files are deleted first. Files of previous runs are
+    counted when the cache is created.
+    """
+
+    def __init__(self, max_items=32, cache_dir=None, max_disk_bytes=None):
+        self.max_items = max_items
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.items = OrderedDict()
+        # Key -> file size of the on-disk tier, least recently used first
+        self.disk_items = OrderedDict()
+        self.disk_bytes = 0
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            self.scan_disk()
+
+    def disk_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.npy")
+
+    def scan_disk(self):
+        """Load the files of the on-disk tier, oldest first, and prune it"""
+        files = []
+        for entry in os.scandir(self.cache_dir):
+            if (
+                not entry.is_file()
+                or not entry.name.endswith(".npy")
+                or entry.name.endswith(".tmp.npy")
+            ):
+                continue
+            stat = entry.stat()
+            files.append((stat.st_mtime_ns, entry.name[:-4], stat.st_size))
+        for _, key, size in sorted(files):
+            self.disk_items[key] = size
+            self.disk_bytes += size
+        self.prune_disk()
+
+    def get(self, key):
+        """Return cached array or None"""
+        if key in self.items:
+            self.items.move_to_end(key)
+            return self.items[key]
+
+        if not self.cache_dir or not os.path.isfile(self.disk_path(key)):
+            return None
+        try:
+            value = np.load(self.disk_path(key))
+        except (OSError, ValueError) as e:
+            logging.warning("Could not read cached candidates: %s", e)
+            return None
+        if key in self.disk_items:
+            self.disk_items.move_to_end(key)
+            # Keep the order for the next scan
+            try:
+                os.utime(self.disk_path(key))
+            except OSError:
+                pass
+        self.put_memory(key, value)
+        return value
+
+    def put(self, key, value):
+        """Add an array to the cache"""
+        self.put_memory(key, value)
+        if not self.cache_dir:
+            return
+        tmp_path = f"{self.disk_path(key)}.tmp.npy"
+        try:
+            np.save(tmp_path, value)
+            os.replace(tmp_path, self.disk_path(key))
+            size = os.path.getsize(self.disk_path(key))
+        except OSError as e:
+            logging.warning("Could not write cached candidates: %s", e)
+            return
+        self.disk_bytes += size - self.disk_items.pop(key, 0)
+        self.disk_items[key] = size
+        self.prune_disk()
+
+    def put_memory(self, key, value):
+        self.items[key] = value
+        self.items.move_to_end(key)
+        while len(self.items) > self.max_items:
+            self.items.popitem(last=False)
+
+    def prune_disk(self):
+        """Delete least recently used files over `max_disk_bytes`"""
+        if self.max_disk_bytes is None:
+            return
+        while self.disk_items and self.disk_bytes > self.max_disk_bytes:
+            key, size = self.disk_items.popitem(last=False)
+            self.disk_bytes -= size
+            try:
+                os.remove(self.disk_path(key))
+            except OSError as e:
+                logging.warning("Could not delete cached candidates: %s", e)
+
+    def clear(self):
+        """Clear the in-memory tier"""
+        self.items.clear()
@@ -0,0 +1,107 @@
+"""
+Dynamic batching for model inference
+Requests from several callers are collected for a short time window and sent
+to the model as one batch.
+"""
+
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class DynamicBatcher:
+    """Collect single-image requests into batched predict calls
+
+    `predict_batch_fn` receives a list of images and must return a list of
+    results in the same order. All batches run on one worker thread, so the
+    underlying model is never used by two threads at once.
+    """
+
+    def __init__(self, predict_batch_fn, max_batch=8, max_wait_ms=5):
+        self.predict_batch_fn = predict_batch_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self.requests = queue.Queue()
+        self.closed = False
+        # Guards `closed`, so that no request is queued after the stop
+        # sentinel
+        self.lock = threading.Lock()
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def submit(self, image):
+        """Queue an image and return a Future of its result"""
+        future = Future()
+        with self.lock:
+            if self.closed:
+                raise RuntimeError("Batcher is closed")
+            self.requests.put((image, future))
+        return future
+
+    def predict(self, image):
+        """Queue an image and wait for its result"""
+        return self.submit(image).result()
+
+    def close(self):
+        """Stop the worker after pending requests are processed"""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.requests.put(None)
+        self.worker.join()
+
+    def collect_batch(self, first_request):
+        """Collect requests until the batch is full or the window expires
+
+        Return (batch, stop), where stop tells the worker to exit.
+        """
+        batch = [first_request]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                request = self.requests.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if request is None:
+                return batch, True
+            batch.append(request)
+        return batch, False
+
+    def run(self):
+        stop = False
+        while not stop:
+            request = self.requests.get()
+            if request is None:
+                break
+            batch, stop = self.collect_batch(request)
+
+            futures = []
+            images = []
+            for image, future in batch:
+                if future.set_running_or_notify_cancel():
+                    futures.append(future)
+                    images.append(image)
+            if not images:
+                continue
+
+            try:
+                results = self.predict_batch_fn(images)
+                if len(results) != len(futures):
+                    raise RuntimeError(
+                        f"Batch prediction returned {len(results)} results"
+                        f" for {len(futures)} images"
+                    )
+            except Exception as e:  # pylint: disable=broad-except
+                logging.warning("Batch prediction failed: %s", e)
+                for future in futures:
+                    future.set_exception(e)
+                continue
+
+            for future, result in zip(futures, results):
+                future.set_result(result)
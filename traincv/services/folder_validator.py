@@ -0,0 +1,83 @@
+"""
+Validate data folders on a thread pool
+Each dropped folder is validated by one pool task, so large folders do not
+block the GUI thread. Tasks report the number of label files found so far and
+can be cancelled.
+"""
+
+import os
+import threading
+
+from PyQt5.QtCore import (QCoreApplication, QObject, QRunnable, Qt,
+                          QThreadPool, pyqtSignal)
+
+
+class FolderValidationTask(QRunnable):
+    """Validate one folder with DataSubsetPreparator.is_valid_data_folder"""
+
+    def __init__(self, validator, task_id, path):
+        super().__init__()
+        self.validator = validator
+        self.task_id = task_id
+        self.path = path
+
+    def run(self):
+        def report_progress(num_labels):
+            self.validator.progress.emit(self.task_id, num_labels)
+
+        try:
+            ret, result = self.validator.data_preparator.is_valid_data_folder(
+                self.path,
+                progress_callback=report_progress,
+                is_cancelled=lambda: self.validator.is_cancelled(self.task_id),
+            )
+        except Exception as e:  # pylint: disable=broad-except
+            ret, result = False, f"Failed to read folder ({e})"
+        if self.validator.is_cancelled(self.task_id):
+            ret, result = False, "Cancelled"
+        self.validator.finished.emit(self.task_id, ret, result)
+
+
+class FolderValidator(QObject):
+    """Run folder validation tasks of a DataSubsetPreparator
+
+    `finished(task_id, ret, result)` carries the return values of
+    is_valid_data_folder. Signals are delivered in the thread of the
+    validator (the GUI thread).
+    """
+
+    progress = pyqtSignal(int, int)
+    finished = pyqtSignal(int, bool, object)
+
+    def __init__(self, data_preparator, max_workers=None):
+        super().__init__()
+        self.data_preparator = data_preparator
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(max_workers or min(4, os.cpu_count() or 1))
+        self.next_task_id = 0
+        self.cancelled_ids = set()
+        self.lock = threading.Lock()
+        app = QCoreApplication.instance()
+        if app is not None:
+            app.aboutToQuit.connect(self.stop, Qt.DirectConnection)
+
+    def validate(self, path):
+        """Start validating a folder and return the task id"""
+        task_id = self.next_task_id
+        self.next_task_id += 1
+        self.pool.start(FolderValidationTask(self, task_id, path))
+        return task_id
+
+    def cancel(self, task_id):
+        with self.lock:
+            self.cancelled_ids.add(task_id)
+
+    def is_cancelled(self, task_id):
+        with self.lock:
+            return task_id in self.cancelled_ids
+
+    def stop(self):
+        """Cancel all tasks and wait for them"""
+        with self.lock:
+            self.cancelled_ids.update(range(self.next_task_id))
+        self.pool.waitForDone()
@@ -0,0 +1,110 @@
+"""
+Inference backends for ONNX detection models
+A backend runs the forward pass on a 4D NCHW float32 blob and returns the list
+of network outputs. The backend is selected by the `backend` key of the model
+config; `backend_options` holds backend-specific settings.
+"""
+
+import cv2
+import numpy as np
+
+
+class OpenCVBackend:
+    """Run models with OpenCV DNN"""
+
+    def __init__(self, model_path, options=None):
+        options = options or {}
+        self.net = cv2.dnn.readNet(model_path)
+        if "num_threads" in options:
+            cv2.setNumThreads(options["num_threads"])
+
+    def forward(self, blob):
+        # Sets the input to the network.
+        self.net.setInput(blob)
+
+        # Runs the forward pass to get output of the output layers.
+        output_layers = self.net.getUnconnectedOutLayersNames()
+        return self.net.forward(output_layers)
+
+
+class ONNXRuntimeBackend:
+    """Run models with ONNX Runtime on CPU
+
+    Options:
+        intra_op_num_threads: threads used inside an operator (0: default)
+        inter_op_num_threads: threads used across operators (0: default)
+        graph_optimization_level: disable, basic, extended or all
+        execution_mode: sequential or parallel
+    """
+
+    GRAPH_OPTIMIZATION_LEVELS = {
+        "disable": "ORT_DISABLE_ALL",
+        "basic": "ORT_ENABLE_BASIC",
+        "extended": "ORT_ENABLE_EXTENDED",
+        "all": "ORT_ENABLE_ALL",
+    }
+    EXECUTION_MODES = {
+        "sequential": "ORT_SEQUENTIAL",
+        "parallel": "ORT_PARALLEL",
+    }
+
+    def __init__(self, model_path, options=None):
+        try:
+            import onnxruntime as ort  # pylint: disable=import-outside-toplevel
+        except ImportError as e:
+            raise Exception(
+                "ONNX Runtime backend requires onnxruntime. "
+                "Install it with: pip install onnxruntime"
+            ) from e
+
+        options = options or {}
+        optimization_level = options.get("graph_optimization_level", "all")
+        if optimization_level not in self.GRAPH_OPTIMIZATION_LEVELS:
+            raise Exception(
+                f"Unknown graph_optimization_level: {optimization_level}"
+            )
+        execution_mode = options.get("execution_mode", "sequential")
+        if execution_mode not in self.EXECUTION_MODES:
+            raise Exception(f"Unknown execution_mode: {execution_mode}")
+
+        session_options = ort.SessionOptions()
+        session_options.intra_op_num_threads = options.get(
+            "intra_op_num_threads", 0
+        )
+        session_options.inter_op_num_threads = options.get(
+            "inter_op_num_threads", 0
+        )
+        session_options.graph_optimization_level = getattr(
+            ort.GraphOptimizationLevel,
+            self.GRAPH_OPTIMIZATION_LEVELS[optimization_level],
+        )
+        session_options.execution_mode = getattr(
+            ort.ExecutionMode, self.EXECUTION_MODES[execution_mode]
+        )
+
+        self.session = ort.InferenceSession(
+            model_path,
+            sess_options=session_options,
+            providers=["CPUExecutionProvider"],
+        )
+        self.input_name = self.session.get_inputs()[0].name
+
+    def forward(self, blob):
+        blob = np.ascontiguousarray(blob, dtype=np.float32)
+        return self.session.run(None, {self.input_name: blob})
+
+
+BACKENDS = {
+    "opencv": OpenCVBackend,
+    "onnxruntime": ONNXRuntimeBackend,
+}
+
+
+def create_backend(name, model_path, options=None):
+    """Create an inference backend by name"""
+    if name not in BACKENDS:
+        raise Exception(
+            f"Unknown backend: {name}. Supported backends:"
+            f" {', '.join(BACKENDS)}"
+        )
+    return BACKENDS[name](model_path, options)
@@ -0,0 +1,125 @@
+"""
+Background writer of label files
+Auto-saved labels are written on a separate thread, so that editing shapes
+does not wait for JSON encoding and disk writes. Saves of the same file
+within `delay` seconds are coalesced into one write, and a file is written
+at most `max_delay` seconds after its first pending save.
+"""
+
+import threading
+import time
+
+from PyQt5.QtCore import QCoreApplication, QObject, Qt, pyqtSignal
+
+from traincv.views.labeling.labelme.label_file import LabelFile
+
+SAVE_DELAY = 0.5
+MAX_SAVE_DELAY = 2.0
+
+
+class LabelWriter(QObject):
+    """Write label files with LabelFile.save on a background thread
+
+    `failed(filename, message)` is emitted when a write fails. Pending
+    writes are flushed when the application quits.
+    """
+
+    failed = pyqtSignal(str, str)
+
+    def __init__(self, delay=SAVE_DELAY, max_delay=MAX_SAVE_DELAY):
+        super().__init__()
+        self.delay = delay
+        self.max_delay = max_delay
+        # filename -> [LabelFile.save arguments, due time, deadline]
+        self.pending = {}
+        self.writing = None
+        self.stopped = False
+        self.condition = threading.Condition()
+        self.writer_thread = threading.Thread(
+            target=self.run, name="LabelWriter", daemon=True
+        )
+        self.writer_thread.start()
+        app = QCoreApplication.instance()
+        if app is not None:
+            app.aboutToQuit.connect(self.close, Qt.DirectConnection)
+
+    def save(self, filename, **kwargs):
+        """Schedule LabelFile().save(filename, **kwargs)
+
+        Arguments must not be changed by the caller afterwards.
+        """
+        with self.condition:
+            if not self.stopped:
+                now = time.monotonic()
+                deadline = now + self.max_delay
+                if filename in self.pending:
+                    deadline = self.pending[filename][2]
+                self.pending[filename] = [
+                    kwargs,
+                    min(now + self.delay, deadline),
+                    deadline,
+                ]
+                self.condition.notify_all()
+                return
+        # Closed: write in the calling thread
+        self.write(filename, kwargs)
+
+    def flush(self):
+        """Write all pending files now and wait for them"""
+        with self.condition:
+            for item in self.pending.values():
+                item[1] = 0
+            self.condition.notify_all()
+            while self.pending or self.writing is not None:
+                self.condition.wait()
+
+    def close(self):
+        """Flush pending files and stop the writer thread"""
+        self.flush()
+        with self.condition:
+            self.stopped = True
+            self.condition.notify_all()
+        self.writer_thread.join()
+
+    def next_write(self):
+        """Wait for the next due file, return (filename, arguments)
+
+        Return None when the writer is stopped.
+        """
+        with self.condition:
+            while True:
+                if self.stopped and not self.pending:
+                    return None
+                if not self.pending:
+                    self.condition.wait()
+                    continue
+                due_time, filename = min(
+                    (item[1], filename)
+                    for filename, item in self.pending.items()
+                )
+                now = time.monotonic()
+                if due_time <= now:
+                    self.writing = filename
+                    return filename, self.pending.pop(filename)[0]
+                self.condition.wait(due_time - now)
+
+    def run(self):
+        while True:
+            item = self.next_write()
+            if item is None:
+                return
+            filename, kwargs = item
+            try:
+                self.write(filename, kwargs)
+            finally:
+                with self.condition:
+                    self.writing = None
+                    self.condition.notify_all()
+
+    def write(self, filename, kwargs):
+        # Any error is reported: the writer thread must keep running, or
+        # flush() would wait forever
+        try:
+            LabelFile().save(filename=filename, **kwargs)
+        except Exception as e:  # pylint: disable=broad-except
+            self.failed.emit(filename, str(e))
@@ -7,6 +7,9 @@ import numpy as np
 import yaml
 from PyQt5 import QtCore
 
+from traincv.services.candidate_cache import (CandidateCache, hash_file,
+                                              hash_image)
+from traincv.services.inference_backends import create_backend
 from traincv.views.labeling.labelme.shape import Shape
 from traincv.views.labeling.labelme.utils.opencv import qt_img_to_cv_img
 
@@ -15,15 +18,21 @@ INPUT_HEIGHT = 640
 SCORE_THRESHOLD = 0.5
 NMS_THRESHOLD = 0.45
 CONFIDENCE_THRESHOLD = 0.45
+CANDIDATE_CACHE_SIZE = 32
+# Size limit of the on-disk candidate cache, in MB
+CANDIDATE_CACHE_DIR_SIZE_MB = 512
+LETTERBOX_PAD_VALUE = 114
 
 
 class YOLOv5Predictor:
-    def __init__(self, config_path) -> None:
+    def __init__(self, config_path, config_overrides=None) -> None:
         if not os.path.isfile(config_path):
             raise Exception(f"Config file not found: {config_path}")
 
         with open(config_path, "r") as f:
             self.config = yaml.safe_load(f)
+        if config_overrides:
+            self.config.update(config_overrides)
 
         self.check_missing_config(
             config_names=[
@@ -44,23 +53,183 @@ class YOLOv5Predictor:
         if not os.path.isfile(model_abs_path):
             raise Exception(f"Model not found: {model_abs_path}")
 
-        self.net = cv2.dnn.readNet(model_abs_path)
+        self.backend_name = self.config.get("backend", "opencv")
+        self.net = create_backend(
+            self.backend_name,
+            model_abs_path,
+            self.config.get("backend_options"),
+        )
         self.classes = self.config["classes"]
 
+        # Letterbox input buffer, reused across calls
+        self.input_buffer = None
+
+        # Raw candidates are cached per (model, input size, image content),
+        # so threshold changes do not re-run the network
+        self.model_hash = hash_file(model_abs_path)
+        cache_dir = self.config.get("cache_dir")
+        if cache_dir:
+            cache_dir = os.path.join(config_folder, cache_dir)
+        cache_dir_size_mb = self.config.get(
+            "cache_dir_size_mb", CANDIDATE_CACHE_DIR_SIZE_MB
+        )
+        self.candidate_cache = CandidateCache(
+            max_items=self.config.get("cache_size", CANDIDATE_CACHE_SIZE),
+            cache_dir=cache_dir,
+            max_disk_bytes=cache_dir_size_mb * 1024 * 1024,
+        )
+
     def check_missing_config(self, config_names, config):
         for name in config_names:
             if name not in config:
                 raise Exception(f"Missing config: {name}")
 
+    def update_thresholds(
+        self,
+        score_threshold=None,
+        nms_threshold=None,
+        confidence_threshold=None,
+    ):
+        """Update thresholds. Cached candidates stay valid"""
+        if score_threshold is not None:
+            self.config["score_threshold"] = score_threshold
+        if nms_threshold is not None:
+            self.config["nms_threshold"] = nms_threshold
+        if confidence_threshold is not None:
+            self.config["confidence_threshold"] = confidence_threshold
+
+    def warm_up(self):
+        """Run one forward pass so that the first prediction is fast"""
+        blob = np.zeros(
+            (1, 3, self.config["input_height"], self.config["input_width"]),
+            dtype=np.float32,
+        )
+        self.forward(self.net, blob)
+
+    def cache_key(self, image):
+        width, height = self.config["input_width"], self.config["input_height"]
+        mode = "letterbox" if self.config.get("letterbox") else "stretch"
+        return (
+            f"{self.model_hash}-{self.backend_name}-{width}x{height}-{mode}"
+            f"-{hash_image(image)}"
+        )
+
     def predict(self, image):
-        detections = self.pre_process(image, self.net)
-        results = self.post_process(image, detections)
+        if self.config.get("tile_size"):
+            return self.predict_tiled(image)
+
+        key = self.cache_key(image)
+        candidates = self.candidate_cache.get(key)
+        if candidates is None:
+            detections = self.pre_process(image, self.net)
+            candidates = self.extract_candidates(detections[0][0])
+            self.candidate_cache.put(key, candidates)
+        results = self.post_process_candidates(image, candidates)
         return results
 
+    def predict_batch(self, images, max_batch=8):
+        """Predict boxes for a list of images
+
+        Images are sent to the network in chunks of at most `max_batch`
+        images. The model must be exported with a dynamic batch axis to
+        accept more than one image per forward pass. Images with cached
+        candidates are not sent to the network.
+        Return a list of box lists, one per input image.
+        """
+        if self.config.get("tile_size"):
+            return [self.predict_tiled(image) for image in images]
+
+        candidates = self.get_candidates_batch(images, max_batch)
+        return [
+            self.post_process_candidates(image, image_candidates)
+            for image, image_candidates in zip(images, candidates)
+        ]
+
+    def get_candidates_batch(self, images, max_batch=8):
+        """Return candidates of a list of images, using cache if possible"""
+        keys = [self.cache_key(image) for image in images]
+        candidates = [self.candidate_cache.get(key) for key in keys]
+        missing = [i for i, c in enumerate(candidates) if c is None]
+        for start in range(0, len(missing), max_batch):
+            chunk = missing[start : start + max_batch]
+            blob = self.make_blob([images[i] for i in chunk])
+            outputs = self.forward(self.net, blob)
+            for j, i in enumerate(chunk):
+                candidates[i] = self.extract_candidates(outputs[0][j])
+                self.candidate_cache.put(keys[i], candidates[i])
+        return candidates
+
+    @staticmethod
+    def get_tile_offsets(length, tile_size, overlap):
+        """Return start offsets of tiles covering [0, length)"""
+        if length <= tile_size:
+            return [0]
+        stride = max(tile_size - overlap, 1)
+        offsets = list(range(0, length - tile_size, stride))
+        offsets.append(length - tile_size)
+        return offsets
+
+    def predict_tiled(self, image):
+        """Predict boxes on overlapping tiles of a large image
+
+        Tiles are `tile_size` pixels wide and overlap by `tile_overlap`
+        pixels. Tiles with almost no content (standard deviation of pixel
+        values below `tile_min_std`) are skipped. Boxes of all tiles are
+        merged with one global NMS.
+        """
+        tile_size = self.config["tile_size"]
+        overlap = self.config.get("tile_overlap", tile_size // 5)
+        min_std = self.config.get("tile_min_std", 2.0)
+        image_height, image_width = image.shape[:2]
+
+        tiles = []
+        tile_origins = []
+        for y in self.get_tile_offsets(image_height, tile_size, overlap):
+            for x in self.get_tile_offsets(image_width, tile_size, overlap):
+                tile = image[y : y + tile_size, x : x + tile_size]
+                _, std = cv2.meanStdDev(tile)
+                if std.max() < min_std:
+                    continue
+                tiles.append(tile)
+                tile_origins.append((x, y))
+
+        all_boxes = [np.zeros((0, 4), dtype=int)]
+        all_confidences = [np.zeros((0,), dtype=np.float32)]
+        all_class_ids = [np.zeros((0,), dtype=int)]
+        candidates = self.get_candidates_batch(
+            tiles, self.config.get("tile_batch_size", 8)
+        )
+        for tile, tile_candidates, (x, y) in zip(
+            tiles, candidates, tile_origins
+        ):
+            tile_height, tile_width = tile.shape[:2]
+            boxes, confidences, class_ids = self.filter_candidates(
+                tile_candidates, tile_width, tile_height
+            )
+            boxes[:, 0] += x
+            boxes[:, 1] += y
+            all_boxes.append(boxes)
+            all_confidences.append(confidences)
+            all_class_ids.append(class_ids)
+
+        return self.nms_boxes(
+            np.concatenate(all_boxes),
+            np.concatenate(all_confidences),
+            np.concatenate(all_class_ids),
+        )
+
     def pre_process(self, input_image, net):
         # Create a 4D blob from a frame.
-        blob = cv2.dnn.blobFromImage(
-            input_image,
+        blob = self.make_blob([input_image])
+
+        return self.forward(net, blob)
+
+    def make_blob(self, images):
+        """Create a 4D blob (NCHW, RGB, scaled to [0, 1]) from images"""
+        if self.config.get("letterbox"):
+            return self.letterbox_blob(images)
+        return cv2.dnn.blobFromImages(
+            images,
             1 / 255,
             (self.config["input_width"], self.config["input_height"]),
             [0, 0, 0],
@@ -68,73 +237,87 @@ class YOLOv5Predictor:
             crop=False,
         )
 
-        # Sets the input to the network.
-        net.setInput(blob)
-
-        # Runs the forward pass to get output of the output layers.
-        output_layers = net.getUnconnectedOutLayersNames()
-        outputs = net.forward(output_layers)
-
-        return outputs
+    def get_letterbox_params(self, image_width, image_height):
+        """Return (scale, pad_x, pad_y) of the letterbox transform"""
+        input_width = self.config["input_width"]
+        input_height = self.config["input_height"]
+        scale = min(input_width / image_width, input_height / image_height)
+        resized_width = round(image_width * scale)
+        resized_height = round(image_height * scale)
+        pad_x = (input_width - resized_width) // 2
+        pad_y = (input_height - resized_height) // 2
+        return scale, pad_x, pad_y
+
+    def letterbox_blob(self, images):
+        """Resize images keeping aspect ratio and pad them into a blob
+
+        The blob is a view of a float32 buffer which is reused across
+        calls, so it is only valid until the next call.
+        """
+        input_width = self.config["input_width"]
+        input_height = self.config["input_height"]
+        if self.input_buffer is None or len(self.input_buffer) < len(images):
+            self.input_buffer = np.empty(
+                (len(images), 3, input_height, input_width), dtype=np.float32
+            )
+
+        blob = self.input_buffer[: len(images)]
+        blob.fill(LETTERBOX_PAD_VALUE / 255)
+        for image, output in zip(images, blob):
+            image_height, image_width = image.shape[:2]
+            scale, pad_x, pad_y = self.get_letterbox_params(
+                image_width, image_height
+            )
+            resized_width = round(image_width * scale)
+            resized_height = round(image_height * scale)
+            if (resized_width, resized_height) != (image_width, image_height):
+                image = cv2.resize(
+                    image,
+                    (resized_width, resized_height),
+                    interpolation=cv2.INTER_LINEAR,
+                )
+
+            # HWC BGR uint8 -> CHW RGB float32, written in place
+            np.multiply(
+                image.transpose(2, 0, 1)[::-1],
+                np.float32(1 / 255),
+                out=output[
+                    :,
+                    pad_y : pad_y + resized_height,
+                    pad_x : pad_x + resized_width,
+                ],
+                casting="unsafe",
+            )
+        return blob
+
+    def forward(self, net, blob):
+        return net.forward(blob)
 
     def post_process(self, input_image, outputs):
-        # Lists to hold respective values while unwrapping.
-        class_ids = []
-        confidences = []
-        boxes = []
-
-        # Rows.
-        rows = outputs[0].shape[1]
+        candidates = self.extract_candidates(outputs[0][0])
+        return self.post_process_candidates(input_image, candidates)
 
+    def post_process_candidates(self, input_image, candidates):
         image_height, image_width = input_image.shape[:2]
+        boxes, confidences, class_ids = self.filter_candidates(
+            candidates, image_width, image_height
+        )
+        return self.nms_boxes(boxes, confidences, class_ids)
 
-        # Resizing factor.
-        x_factor = image_width / self.config["input_width"]
-        y_factor = image_height / self.config["input_height"]
-
-        # Iterate through 25200 detections.
-        for r in range(rows):
-            row = outputs[0][0][r]
-            confidence = row[4]
-
-            # Discard bad detections and continue.
-            if confidence >= self.config["confidence_threshold"]:
-                classes_scores = row[5:]
-
-                # Get the index of max class score.
-                class_id = np.argmax(classes_scores)
-
-                #  Continue if the class score is above threshold.
-                if classes_scores[class_id] > self.config["score_threshold"]:
-                    confidences.append(confidence)
-                    class_ids.append(class_id)
-
-                    cx, cy, w, h = row[0], row[1], row[2], row[3]
-
-                    left = int((cx - w / 2) * x_factor)
-                    top = int((cy - h / 2) * y_factor)
-                    width = int(w * x_factor)
-                    height = int(h * y_factor)
-
-                    box = np.array([left, top, width, height])
-                    boxes.append(box)
-
+    def nms_boxes(self, boxes, confidences, class_ids):
+        """Run NMS and return output box dicts"""
         # Perform non maximum suppression to eliminate redundant overlapping boxes with
         # lower confidences.
         indices = cv2.dnn.NMSBoxes(
-            boxes,
-            confidences,
+            boxes.tolist(),
+            confidences.tolist(),
             self.config["confidence_threshold"],
             self.config["nms_threshold"],
         )
 
         output_boxes = []
-        for i in indices:
-            box = boxes[i]
-            left = box[0]
-            top = box[1]
-            width = box[2]
-            height = box[3]
+        for i in np.array(indices).reshape(-1):
+            left, top, width, height = boxes[i]
             label = self.classes[class_ids[i]]
             score = confidences[i]
 
@@ -151,6 +334,58 @@ class YOLOv5Predictor:
 
         return output_boxes
 
+    @staticmethod
+    def extract_candidates(predictions):
+        """Reduce raw network rows to threshold-independent candidates
+
+        `predictions` has one row per candidate:
+        (cx, cy, w, h, objectness, class scores...).
+        Return a float32 array with rows
+        (cx, cy, w, h, objectness, max class score, class id).
+        """
+        classes_scores = predictions[:, 5:]
+        class_ids = np.argmax(classes_scores, axis=1)
+        max_scores = classes_scores[np.arange(len(class_ids)), class_ids]
+        return np.column_stack(
+            [predictions[:, :5], max_scores, class_ids]
+        ).astype(np.float32)
+
+    def filter_candidates(self, candidates, image_width, image_height):
+        """Filter candidates by objectness and class score
+
+        Return (boxes, confidences, class_ids), where boxes are
+        (left, top, width, height) in image coordinates.
+        """
+        # Discard bad detections and keep rows above class score threshold.
+        keep = (candidates[:, 4] >= self.config["confidence_threshold"]) & (
+            candidates[:, 5] > self.config["score_threshold"]
+        )
+        candidates = candidates[keep]
+        confidences = candidates[:, 4]
+        class_ids = candidates[:, 6].astype(int)
+
+        cx, cy, w, h = candidates[:, :4].T
+        if self.config.get("letterbox"):
+            # Undo padding, then use one uniform scale for both axes
+            scale, pad_x, pad_y = self.get_letterbox_params(
+                image_width, image_height
+            )
+            lefts = ((cx - w / 2 - pad_x) / scale).astype(int)
+            tops = ((cy - h / 2 - pad_y) / scale).astype(int)
+            widths = (w / scale).astype(int)
+            heights = (h / scale).astype(int)
+        else:
+            # Resizing factor.
+            x_factor = image_width / self.config["input_width"]
+            y_factor = image_height / self.config["input_height"]
+            lefts = ((cx - w / 2) * x_factor).astype(int)
+            tops = ((cy - h / 2) * y_factor).astype(int)
+            widths = (w * x_factor).astype(int)
+            heights = (h * y_factor).astype(int)
+        boxes = np.stack([lefts, tops, widths, heights], axis=1)
+
+        return boxes, confidences, class_ids
+
     def predict_shapes(self, image):
         if image is None:
             return []
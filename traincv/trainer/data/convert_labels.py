@@ -0,0 +1,144 @@
+"""
+Convert labelme JSON files to compact label files and back
+Converted files are written next to their sources, with the same stem, so a
+folder can hold both formats. Files whose converted file is up to date are
+skipped.
+Example:
+    python -m traincv.trainer.data.convert_labels --input data/ --to compact
+"""
+
+import base64
+import json
+import logging
+import os
+import sys
+
+from traincv.common.compact_label import (COMPACT_LABEL_SUFFIX,
+                                          CompactLabelError,
+                                          read_compact_label,
+                                          write_compact_label)
+from traincv.common.dataset_scanner import LABEL_EXTENSION, scan_files
+from traincv.trainer.data.data_preparation import run_tasks
+
+
+def json_to_compact(json_path, output_path):
+    with open(json_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    if not isinstance(data, dict) or "shapes" not in data:
+        raise CompactLabelError(f"Not a labelme file: {json_path}")
+    tmp_output_path = f"{output_path}.tmp"
+    write_compact_label(tmp_output_path, data)
+    os.replace(tmp_output_path, output_path)
+
+
+def compact_to_json(compact_path, output_path):
+    data, _ = read_compact_label(compact_path)
+    if data["imageData"] is not None:
+        data["imageData"] = base64.b64encode(data["imageData"]).decode(
+            "utf-8"
+        )
+    tmp_output_path = f"{output_path}.tmp"
+    with open(tmp_output_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    os.replace(tmp_output_path, output_path)
+
+
+# Target format: (source extension, target extension, converter)
+CONVERTERS = {
+    "compact": (LABEL_EXTENSION, COMPACT_LABEL_SUFFIX, json_to_compact),
+    "json": (COMPACT_LABEL_SUFFIX, LABEL_EXTENSION, compact_to_json),
+}
+
+
+def convert_label_file_task(task):
+    """Convert a file, return (source path, error message or None)"""
+    to_format, source_path, output_path = task
+    try:
+        CONVERTERS[to_format][2](source_path, output_path)
+    except (OSError, ValueError, KeyError, CompactLabelError) as e:
+        return source_path, str(e)
+    return source_path, None
+
+
+def convert_label_files(
+    input_path, to_format="compact", num_workers=None, overwrite=False
+):
+    """Convert all label files under input_path
+
+    Return (number of converted files, number of up-to-date files,
+    list of (source path, error message)).
+    """
+    if to_format not in CONVERTERS:
+        raise Exception(
+            f"Unsupported label format: {to_format}. Supported formats:"
+            f" {', '.join(CONVERTERS)}"
+        )
+    source_extension, target_extension, _ = CONVERTERS[to_format]
+
+    tasks = []
+    num_skipped = 0
+    for entry in scan_files(input_path, source_extension):
+        output_path = os.path.splitext(entry.path)[0] + target_extension
+        if not overwrite:
+            try:
+                output_mtime = os.stat(output_path).st_mtime_ns
+                if output_mtime >= entry.stat().st_mtime_ns:
+                    num_skipped += 1
+                    continue
+            except OSError:
+                pass
+        tasks.append((to_format, entry.path, output_path))
+
+    failed = []
+    for source_path, error in run_tasks(
+        convert_label_file_task, tasks, num_workers=num_workers
+    ):
+        if error is not None:
+            logging.warning("Could not convert %s: %s", source_path, error)
+            failed.append((source_path, error))
+    return len(tasks) - len(failed), num_skipped, failed
+
+
+def main(args):
+    num_converted, num_skipped, failed = convert_label_files(
+        args.input,
+        to_format=args.to,
+        num_workers=args.num_workers,
+        overwrite=args.overwrite,
+    )
+    print(
+        f"Converted {num_converted} files, {num_skipped} up to date,"
+        f" {len(failed)} failed"
+    )
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+
+    import argparse
+
+    parser = argparse.ArgumentParser(
+        "Convert labelme JSON files to compact label files and back"
+    )
+    parser.add_argument(
+        "--input", type=str, required=True, help="Folder of label files"
+    )
+    parser.add_argument(
+        "--to",
+        type=str,
+        default="compact",
+        choices=list(CONVERTERS),
+        help="Target label format",
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=None,
+        help="Number of conversion processes. Default: number of CPUs",
+    )
+    parser.add_argument(
+        "--overwrite",
+        action="store_true",
+        help="Convert files even if their converted file is up to date",
+    )
+    sys.exit(main(parser.parse_args()))
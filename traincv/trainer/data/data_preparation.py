@@ -1,18 +1,47 @@
+import functools
+import hashlib
 import json
 import logging
+import multiprocessing
 import os
 import pathlib
-import random
+import shutil
 import sys
-import uuid
 
 import cv2
-from imutils import paths
+import numpy as np
+
+from traincv.common.dataset_scanner import scan_dataset
+from traincv.common.image_metadata import read_image_metadata
+from traincv.trainer.data.packed_dataset import (DEFAULT_SHARD_SIZE,
+                                                 ShardWriter)
 
 logging.getLogger().setLevel(logging.DEBUG)
 
 label_id_map = {"object": 1}
 
+# Image formats which can be used for training without re-encoding
+YOLO_IMAGE_EXTENSIONS = (
+    ".bmp",
+    ".jpg",
+    ".jpeg",
+    ".png",
+    ".tif",
+    ".tiff",
+    ".webp",
+)
+IMAGE_TRANSFER_MODES = ("copy", "hardlink", "reflink", "reencode")
+# ioctl request to clone a file (Linux: Btrfs, XFS...)
+FICLONE = 0x40049409
+# Manifest of converted samples, stored in each output folder
+MANIFEST_FILE = ".traincv_manifest.json"
+MANIFEST_VERSION = 1
+# COCO output: images folder and annotation file in each output folder
+COCO_IMAGES_FOLDER = "images"
+COCO_ANNOTATION_FILE = "annotations.json"
+# Number of polygon vertices of a circle in YOLO-seg labels
+CIRCLE_POLYGON_VERTICES = 32
+
 
 def str2bool(v):
     return v.lower() in ("yes", "true", "t", "1")
@@ -20,14 +49,139 @@ def str2bool(v):
 
 def scan_labelme_labels(root_path):
     """Scan a root path and return list of (image_file, label_file)"""
-    dataset = []
-    image_paths = list(paths.list_images(root_path))
-    for image_path in image_paths:
-        pre_name, _ = os.path.splitext(image_path)
-        label_path = f"{pre_name}.json"
-        if os.path.isfile(label_path):
-            dataset.append((image_path, label_path))
-    return dataset
+    return [
+        (image_path, label_path)
+        for image_path, label_path in scan_dataset(root_path)
+        if label_path is not None
+    ]
+
+
+def reflink_file(src, dst):
+    """Clone a file with copy-on-write. Return False if not supported"""
+    try:
+        import fcntl  # pylint: disable=import-outside-toplevel
+    except ImportError:
+        return False
+    try:
+        with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+            fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+        return True
+    except OSError:
+        if os.path.exists(dst):
+            os.remove(dst)
+        return False
+
+
+def transfer_file(src, dst, mode="copy"):
+    """Copy, hardlink or reflink a file without changing its bytes
+
+    Hardlink and reflink fall back to a plain copy when the filesystem
+    does not support them.
+    """
+    if os.path.lexists(dst):
+        os.remove(dst)
+    if mode == "hardlink":
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+    elif mode == "reflink" and reflink_file(src, dst):
+        return
+    shutil.copyfile(src, dst)
+
+
+def hash_sample(image_path, label_path, chunk_size=1 << 20):
+    """Return a content hash of an image and its label file"""
+    hasher = hashlib.blake2b(digest_size=16)
+    for path in (image_path, label_path):
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                hasher.update(chunk)
+        # Separate the two files in the hashed stream
+        hasher.update(b"\0")
+    return hasher.hexdigest()
+
+
+def split_value(relative_path):
+    """Return a stable value in [0, 1) of a sample path
+
+    Samples are split by comparing this value with split ratios, so the
+    split of a sample does not change when other samples are added or
+    removed.
+    """
+    digest = hashlib.blake2b(
+        relative_path.replace(os.sep, "/").encode("utf-8"), digest_size=8
+    ).digest()
+    return int.from_bytes(digest, "big") / 2**64
+
+
+def split_samples(samples, split_values, start, end):
+    """Split samples whose split value is in [start, end)
+
+    Return (split samples, other samples). If no value is in the range,
+    the sample with the smallest value from `start` is split, so that the
+    split set is not empty.
+    """
+    selected = []
+    others = []
+    for sample in samples:
+        if start <= split_values[sample] < end:
+            selected.append(sample)
+        else:
+            others.append(sample)
+    if not selected and others:
+        sample = min(
+            others,
+            key=lambda sample: (
+                split_values[sample] < start,
+                split_values[sample],
+            ),
+        )
+        others.remove(sample)
+        selected.append(sample)
+    return selected, others
+
+
+def get_file_signature(path):
+    """Return (mtime_ns, size) of a file"""
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def load_manifest(output_path):
+    """Load the conversion manifest of an output folder
+
+    The manifest has two maps: "sources" maps a label path to its image
+    path, file signatures and sample hash, "outputs" maps a sample hash to
+    the output file names of that sample.
+    """
+    manifest_path = os.path.join(output_path, MANIFEST_FILE)
+    empty_manifest = {
+        "version": MANIFEST_VERSION,
+        "sources": {},
+        "outputs": {},
+    }
+    if not os.path.isfile(manifest_path):
+        return empty_manifest
+    try:
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError) as e:
+        logging.warning("Could not read manifest, converting all: %s", e)
+        return empty_manifest
+    if manifest.get("version") != MANIFEST_VERSION:
+        return empty_manifest
+    return manifest
+
+
+def save_manifest(output_path, manifest):
+    """Save the conversion manifest atomically"""
+    manifest_path = os.path.join(output_path, MANIFEST_FILE)
+    tmp_manifest_path = f"{manifest_path}.tmp"
+    with open(tmp_manifest_path, "w") as f:
+        json.dump(manifest, f)
+    os.replace(tmp_manifest_path, manifest_path)
 
 
 def convert_box(size, box):
@@ -45,73 +199,616 @@ def convert_box(size, box):
     return (x, y, w, h)
 
 
-def labelme_to_yolo(img_label_sets, output_path):
-    """Convert a labelme folder to a YOLO folder"""
-    pathlib.Path(output_path).mkdir(exist_ok=True, parents=True)
+def get_yolo_labels(shapes, img_width, img_height):
+    """Return the YOLO label file content of labelme shapes"""
+    lines = []
+    for shape in shapes:
+        if len(shape["points"]) != 2:
+            continue
+
+        label = shape["label"]
 
-    len_labels = len(img_label_sets)
-    for i, (image_path, label_path) in enumerate(img_label_sets):
-        print(f"{i} / {len_labels}")
-        new_base_name = str(uuid.uuid4())
-        new_image_name = f"{new_base_name}.jpg"
-        output_json_name = f"{new_base_name}.json"
-        output_json_path = os.path.join(output_path, output_json_name)
-        output_label_path = os.path.join(output_path, f"{new_base_name}.txt")
-
-        # Read label
-        with open(label_path, "r") as f:
-            data = json.load(f)
-
-        # Read image
-        img = cv2.imread(image_path)
-        img_height, img_width = img.shape[:2]
-
-        # Output label and jsons
-        data["imagePath"] = new_image_name
-        with open(output_json_path, "w") as f:
-            json.dump(data, f)
+        if label not in label_id_map:
+            logging.warning("Skip label: %s", label)
+            continue
+
+        if shape["shape_type"] != "rectangle":
+            logging.warning(
+                "Shape type is not `rectangle`: %s",
+                shape["shape_type"],
+            )
+            continue
+
+        label_id = label_id_map[label]
+        x1 = shape["points"][0][0]
+        y1 = shape["points"][0][1]
+        x2 = shape["points"][1][0]
+        y2 = shape["points"][1][1]
+
+        xmin = min(x1, x2)
+        xmax = max(x1, x2)
+        ymin = min(y1, y2)
+        ymax = max(y1, y2)
+        bbox = (xmin, xmax, ymin, ymax)
+
+        yolo_bbox = convert_box((img_width, img_height), bbox)
+        lines.append(
+            f"{label_id} {yolo_bbox[0]} {yolo_bbox[1]} {yolo_bbox[2]} {yolo_bbox[3]}\n"
+        )
+    return "".join(lines)
+
+
+def shape_to_polygon(shape):
+    """Return the polygon (N x 2 array) of a labelme shape or None
+
+    Rectangles become 4 corners and circles CIRCLE_POLYGON_VERTICES
+    vertices. Other shapes without an area are not supported.
+    """
+    points = np.asarray(shape["points"], dtype=np.float64)
+    shape_type = shape.get("shape_type", "polygon")
+    if shape_type == "polygon" and len(points) >= 3:
+        return points[:, :2]
+    if shape_type == "rectangle" and len(points) == 2:
+        (x1, y1), (x2, y2) = points[:, :2]
+        return np.array([[x1, y1], [x2, y1], [x2, y2], [x1, y2]])
+    if shape_type == "circle" and len(points) == 2:
+        center = points[0, :2]
+        radius = np.linalg.norm(points[1, :2] - center)
+        angles = np.linspace(
+            0, 2 * np.pi, CIRCLE_POLYGON_VERTICES, endpoint=False
+        )
+        return center + radius * np.stack(
+            [np.cos(angles), np.sin(angles)], axis=1
+        )
+    return None
+
+
+def get_yolo_seg_labels(shapes, img_width, img_height):
+    """Return the YOLO segmentation label file content of labelme shapes
+
+    Each line is a class id followed by the normalized polygon vertices.
+    All vertices of the file are normalized and clipped at once.
+    """
+    label_ids = []
+    polygons = []
+    for shape in shapes:
+        label = shape["label"]
+        if label not in label_id_map:
+            logging.warning("Skip label: %s", label)
+            continue
+        polygon = shape_to_polygon(shape)
+        if polygon is None:
+            logging.warning(
+                "Shape type `%s` can not be converted to a polygon",
+                shape.get("shape_type"),
+            )
+            continue
+        label_ids.append(label_id_map[label])
+        polygons.append(polygon)
+    if len(polygons) == 0:
+        return ""
+
+    points = np.concatenate(polygons)
+    points /= (img_width, img_height)
+    np.clip(points, 0.0, 1.0, out=points)
+    ends = np.cumsum([len(polygon) for polygon in polygons])
+    lines = []
+    for label_id, polygon in zip(label_ids, np.split(points, ends[:-1])):
+        coordinates = " ".join(map("{:.6f}".format, polygon.ravel().tolist()))
+        lines.append(f"{label_id} {coordinates}\n")
+    return "".join(lines)
+
+
+def prepare_image(image_path, transfer_mode="copy"):
+    """Decide how to output an image
+
+    Return (img, img_width, img_height, output extension). `img` is the
+    decoded image when it must be re-encoded as JPEG, None otherwise.
+    """
+    # Labelme applies EXIF orientation, so rotated images are re-encoded
+    # for the labels to match the pixels
+    ext = os.path.splitext(image_path)[1].lower()
+    reencode = transfer_mode == "reencode" or ext not in YOLO_IMAGE_EXTENSIONS
+    if not reencode:
+        metadata = read_image_metadata(image_path)
+        reencode = metadata.orientation != 1
+    if not reencode:
+        return None, metadata.width, metadata.height, ext
+
+    img = cv2.imread(image_path)
+    img_height, img_width = img.shape[:2]
+    return img, img_width, img_height, ".jpg"
+
+
+def convert_labelme_sample(
+    image_path,
+    label_path,
+    output_path,
+    transfer_mode="copy",
+    base_name=None,
+    segmentation=False,
+):
+    """Convert one labelme sample (image + JSON) to YOLO format
+
+    Images in a format usable for training are transferred unchanged
+    (see `transfer_file`). Other images, images with an EXIF rotation,
+    and all images in "reencode" mode are decoded and written as JPEG.
+    Output files are named after `base_name`, which defaults to the
+    content hash of the sample. With `segmentation`, labels are written
+    as polygons (YOLO-seg) instead of boxes.
+    Return (base_name, output file names).
+    """
+    if base_name is None:
+        base_name = hash_sample(image_path, label_path)
+    new_base_name = base_name
+    output_json_name = f"{new_base_name}.json"
+    output_json_path = os.path.join(output_path, output_json_name)
+    output_label_path = os.path.join(output_path, f"{new_base_name}.txt")
+
+    # Read label
+    with open(label_path, "r") as f:
+        data = json.load(f)
+
+    img, img_width, img_height, image_ext = prepare_image(
+        image_path, transfer_mode
+    )
+    new_image_name = f"{new_base_name}{image_ext}"
+    if img is not None:
         cv2.imwrite(os.path.join(output_path, new_image_name), img)
+    else:
+        transfer_file(
+            image_path,
+            os.path.join(output_path, new_image_name),
+            transfer_mode,
+        )
+
+    # Output jsons
+    data["imagePath"] = new_image_name
+    with open(output_json_path, "w") as f:
+        json.dump(data, f)
+
+    get_labels = get_yolo_seg_labels if segmentation else get_yolo_labels
+    with open(output_label_path, "w") as f:
+        f.write(get_labels(data["shapes"], img_width, img_height))
+
+    output_files = [
+        new_image_name,
+        output_json_name,
+        os.path.basename(output_label_path),
+    ]
+    return new_base_name, output_files
 
-        with open(output_label_path, "w") as f:
-            shapes = data["shapes"]
-            for shape in shapes:
-                if len(shape["points"]) != 2:
-                    continue
-
-                label = shape["label"]
-
-                if label not in label_id_map:
-                    logging.warning("Skip label: %s", label)
-                    continue
-
-                if shape["shape_type"] != "rectangle":
-                    logging.warning(
-                        "Shape type is not `rectangle`: %s",
-                        shape["shape_type"],
-                    )
-                    continue
-
-                label_id = label_id_map[label]
-                x1 = shape["points"][0][0]
-                y1 = shape["points"][0][1]
-                x2 = shape["points"][1][0]
-                y2 = shape["points"][1][1]
-
-                xmin = min(x1, x2)
-                xmax = max(x1, x2)
-                ymin = min(y1, y2)
-                ymax = max(y1, y2)
-                bbox = (xmin, xmax, ymin, ymax)
-
-                yolo_bbox = convert_box((img_width, img_height), bbox)
-                f.write(
-                    f"{label_id} {yolo_bbox[0]} {yolo_bbox[1]} {yolo_bbox[2]} {yolo_bbox[3]}\n"
+
+def pack_labelme_sample(image_path, label_path, transfer_mode="copy"):
+    """Convert one labelme sample to YOLO format in memory
+
+    Images follow the same rules as `convert_labelme_sample`. The key is
+    the content hash of the sample.
+    Return (key, [(extension, bytes)]) for ShardWriter.write.
+    """
+    key = hash_sample(image_path, label_path)
+    with open(label_path, "r") as f:
+        data = json.load(f)
+
+    img, img_width, img_height, image_ext = prepare_image(
+        image_path, transfer_mode
+    )
+    if img is not None:
+        image_data = cv2.imencode(".jpg", img)[1].tobytes()
+    else:
+        with open(image_path, "rb") as f:
+            image_data = f.read()
+
+    data["imagePath"] = f"{key}{image_ext}"
+    labels = get_yolo_labels(data["shapes"], img_width, img_height)
+    return key, [
+        (image_ext[1:], image_data),
+        ("json", json.dumps(data).encode("utf-8")),
+        ("txt", labels.encode("utf-8")),
+    ]
+
+
+def pack_labelme_sample_task(task):
+    """Pool task wrapper of `pack_labelme_sample`"""
+    return pack_labelme_sample(*task)
+
+
+def convert_labelme_sample_task(task):
+    """Pool task wrapper of `convert_labelme_sample`
+
+    Return (label_path, sample_hash, output_files).
+    """
+    image_path, label_path, output_path, transfer_mode, segmentation = task
+    sample_hash, output_files = convert_labelme_sample(
+        image_path,
+        label_path,
+        output_path,
+        transfer_mode,
+        segmentation=segmentation,
+    )
+    return label_path, sample_hash, output_files
+
+
+def log_progress(done, total):
+    """Default progress callback of `labelme_to_yolo`"""
+    if done % 1000 == 0 or done == total:
+        logging.info("%d / %d", done, total)
+
+
+def run_tasks(task_fn, tasks, num_workers=None, chunk_size=64, ordered=False):
+    """Yield results of `task_fn` over a process pool
+
+    `num_workers=1` runs the tasks in this process. Results come in
+    completion order, or in task order if `ordered` is set.
+    """
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    num_workers = min(num_workers, len(tasks))
+    if num_workers <= 1:
+        for task in tasks:
+            yield task_fn(task)
+        return
+
+    # Several chunks per worker keep the load balanced
+    chunk_size = max(1, min(chunk_size, len(tasks) // (num_workers * 4)))
+    with multiprocessing.Pool(processes=num_workers) as pool:
+        pool_map = pool.imap if ordered else pool.imap_unordered
+        yield from pool_map(task_fn, tasks, chunksize=chunk_size)
+
+
+def labelme_to_yolo(
+    img_label_sets,
+    output_path,
+    num_workers=None,
+    progress_callback=log_progress,
+    chunk_size=64,
+    transfer_mode="copy",
+    segmentation=False,
+):
+    """Convert a labelme folder to a YOLO folder
+
+    Conversion is incremental: output files are named after the content
+    hash of each sample and recorded in a manifest, so only new or
+    changed samples are converted, and outputs of samples which are not
+    in `img_label_sets` anymore are deleted.
+
+    Samples are converted over a process pool of `num_workers` processes
+    (default: number of CPUs). `num_workers=1` converts in this process.
+    `progress_callback(done, total)` is called in this process after each
+    converted sample. Only the command line uses it (log_progress): the
+    Data tab has no conversion step yet. `transfer_mode` is one of
+    IMAGE_TRANSFER_MODES. With `segmentation`, labels are polygons in
+    YOLO-seg format.
+    """
+    if transfer_mode not in IMAGE_TRANSFER_MODES:
+        raise Exception(f"Unknown image transfer mode: {transfer_mode}")
+    pathlib.Path(output_path).mkdir(exist_ok=True, parents=True)
+
+    manifest = load_manifest(output_path)
+    old_sources = manifest["sources"]
+    old_outputs = manifest["outputs"]
+    reusable_outputs = old_outputs
+    if (
+        manifest.get("transfer_mode") != transfer_mode
+        or manifest.get("segmentation", False) != segmentation
+    ):
+        # Outputs depend on the transfer mode and the label format
+        reusable_outputs = {}
+    sources = {}
+    outputs = {}
+
+    # Reuse outputs of samples whose files did not change
+    tasks = []
+    for image_path, label_path in img_label_sets:
+        source = {
+            "image_path": image_path,
+            "image": get_file_signature(image_path),
+            "label": get_file_signature(label_path),
+        }
+        old_source = old_sources.get(label_path, {})
+        sample_hash = old_source.get("hash")
+        if (
+            sample_hash in reusable_outputs
+            and all(old_source.get(k) == v for k, v in source.items())
+            and all(
+                os.path.isfile(os.path.join(output_path, name))
+                for name in reusable_outputs[sample_hash]
+            )
+        ):
+            source["hash"] = sample_hash
+            outputs[sample_hash] = reusable_outputs[sample_hash]
+        else:
+            tasks.append(
+                (
+                    image_path,
+                    label_path,
+                    output_path,
+                    transfer_mode,
+                    segmentation,
                 )
+            )
+        sources[label_path] = source
+    logging.info(
+        "Converting %d samples, %d samples are up to date",
+        len(tasks),
+        len(img_label_sets) - len(tasks),
+    )
+
+    def record(i, result):
+        label_path, sample_hash, output_files = result
+        sources[label_path]["hash"] = sample_hash
+        outputs[sample_hash] = output_files
+        if progress_callback is not None:
+            progress_callback(i + 1, len(tasks))
+
+    for i, result in enumerate(
+        run_tasks(convert_labelme_sample_task, tasks, num_workers, chunk_size)
+    ):
+        record(i, result)
+
+    # Delete outputs of removed or changed samples, and old outputs of
+    # samples converted again with another transfer mode or label format
+    output_names = {name for names in outputs.values() for name in names}
+    for output_files in old_outputs.values():
+        for name in output_files:
+            path = os.path.join(output_path, name)
+            if name not in output_names and os.path.isfile(path):
+                os.remove(path)
+
+    save_manifest(
+        output_path,
+        {
+            "version": MANIFEST_VERSION,
+            "transfer_mode": transfer_mode,
+            "segmentation": segmentation,
+            "sources": sources,
+            "outputs": outputs,
+        },
+    )
+
+
+def labelme_to_yolo_shards(
+    img_label_sets,
+    output_path,
+    num_workers=None,
+    progress_callback=log_progress,
+    chunk_size=64,
+    transfer_mode="copy",
+    shard_size=DEFAULT_SHARD_SIZE,
+):
+    """Convert a labelme folder to a packed YOLO dataset
+
+    Samples are converted like `labelme_to_yolo` and written to tar shards
+    of about `shard_size` bytes (see packed_dataset), in the order of
+    `img_label_sets`. Samples with the same content are written once.
+    """
+    if transfer_mode not in IMAGE_TRANSFER_MODES:
+        raise Exception(f"Unknown image transfer mode: {transfer_mode}")
+    tasks = [
+        (image_path, label_path, transfer_mode)
+        for image_path, label_path in img_label_sets
+    ]
+    keys = set()
+    with ShardWriter(output_path, shard_size) as writer:
+        for i, (key, members) in enumerate(
+            run_tasks(
+                pack_labelme_sample_task,
+                tasks,
+                num_workers,
+                chunk_size,
+                ordered=True,
+            )
+        ):
+            if key not in keys:
+                keys.add(key)
+                writer.write(key, members)
+            if progress_callback is not None:
+                progress_callback(i + 1, len(tasks))
+    logging.info(
+        "Packed %d samples into %d shards", len(keys), len(writer.shard_names)
+    )
+
+
+def get_coco_annotation(shape):
+    """Return a COCO annotation (without ids) of a labelme shape or None
+
+    Rectangles and polygons are supported. Rectangles get a 4-point
+    polygon as segmentation.
+    """
+    points = shape["points"]
+    shape_type = shape.get("shape_type", "polygon")
+    if shape_type == "rectangle" and len(points) == 2:
+        (x1, y1), (x2, y2) = points
+        xmin, xmax = min(x1, x2), max(x1, x2)
+        ymin, ymax = min(y1, y2), max(y1, y2)
+        polygon = [xmin, ymin, xmax, ymin, xmax, ymax, xmin, ymax]
+        area = (xmax - xmin) * (ymax - ymin)
+    elif shape_type == "polygon" and len(points) >= 3:
+        xs = [p[0] for p in points]
+        ys = [p[1] for p in points]
+        xmin, xmax = min(xs), max(xs)
+        ymin, ymax = min(ys), max(ys)
+        polygon = [v for p in points for v in p[:2]]
+        # Shoelace formula
+        area = 0.5 * abs(
+            sum(
+                xs[i] * ys[i - 1] - xs[i - 1] * ys[i]
+                for i in range(len(points))
+            )
+        )
+    else:
+        logging.warning(
+            "Skip shape of type `%s` with %d points", shape_type, len(points)
+        )
+        return None
+    return {
+        "label": shape["label"],
+        "segmentation": [polygon],
+        "area": area,
+        "bbox": [xmin, ymin, xmax - xmin, ymax - ymin],
+        "iscrowd": 0,
+    }
+
+
+def coco_labelme_sample(image_path, label_path, images_path, transfer_mode):
+    """Write the image of a labelme sample and return its COCO data
+
+    Images follow the same rules as `convert_labelme_sample`.
+    Return (key, image file name, width, height, annotations).
+    """
+    key = hash_sample(image_path, label_path)
+    with open(label_path, "r") as f:
+        data = json.load(f)
+
+    img, img_width, img_height, image_ext = prepare_image(
+        image_path, transfer_mode
+    )
+    file_name = f"{key}{image_ext}"
+    output_image_path = os.path.join(images_path, file_name)
+    if img is not None:
+        cv2.imwrite(output_image_path, img)
+    elif not os.path.isfile(output_image_path):
+        transfer_file(image_path, output_image_path, transfer_mode)
+
+    annotations = []
+    for shape in data["shapes"]:
+        annotation = get_coco_annotation(shape)
+        if annotation is not None:
+            annotations.append(annotation)
+    return key, file_name, img_width, img_height, annotations
+
+
+def coco_labelme_sample_task(task):
+    """Pool task wrapper of `coco_labelme_sample`"""
+    return coco_labelme_sample(*task)
+
+
+def labelme_to_coco(
+    img_label_sets,
+    output_path,
+    num_workers=None,
+    progress_callback=log_progress,
+    chunk_size=64,
+    transfer_mode="copy",
+):
+    """Convert a labelme folder to COCO detection / segmentation format
+
+    Images are written to `output_path`/images and annotations to
+    `output_path`/annotations.json. The `images` and `annotations` arrays
+    are written incrementally, annotations through a temporary file, so
+    annotations are not kept in memory. Only the key and image file name
+    of each sample are kept, about 200 bytes per image, to skip duplicate
+    samples and to delete images of a previous export which are no longer
+    in the dataset. Category ids are assigned in order of first appearance
+    and written last.
+    """
+    if transfer_mode not in IMAGE_TRANSFER_MODES:
+        raise Exception(f"Unknown image transfer mode: {transfer_mode}")
+    images_path = os.path.join(output_path, COCO_IMAGES_FOLDER)
+    pathlib.Path(images_path).mkdir(exist_ok=True, parents=True)
+    annotation_file = os.path.join(output_path, COCO_ANNOTATION_FILE)
+    tmp_annotation_file = f"{annotation_file}.tmp"
+    tmp_annotations_part = f"{annotation_file}.annotations.tmp"
+
+    tasks = [
+        (image_path, label_path, images_path, transfer_mode)
+        for image_path, label_path in img_label_sets
+    ]
+    categories = {}
+    # Sample key -> image file name
+    file_names = {}
+    num_images = 0
+    num_annotations = 0
+    separators = (",", ":")
+    with open(tmp_annotation_file, "w") as f, open(
+        tmp_annotations_part, "w+"
+    ) as annotations_f:
+        f.write('{"info":{"description":"Converted by TrainCV"},')
+        f.write('"licenses":[],"images":[')
+        for i, (key, file_name, width, height, annotations) in enumerate(
+            run_tasks(
+                coco_labelme_sample_task,
+                tasks,
+                num_workers,
+                chunk_size,
+                ordered=True,
+            )
+        ):
+            if progress_callback is not None:
+                progress_callback(i + 1, len(tasks))
+            # Samples with the same content are exported once
+            if key in file_names:
+                continue
+            file_names[key] = file_name
+            num_images += 1
+            image = {
+                "id": num_images,
+                "file_name": file_name,
+                "width": width,
+                "height": height,
+            }
+            if num_images > 1:
+                f.write(",")
+            f.write(json.dumps(image, separators=separators))
+
+            for annotation in annotations:
+                label = annotation.pop("label")
+                if label not in categories:
+                    categories[label] = len(categories) + 1
+                num_annotations += 1
+                annotation["id"] = num_annotations
+                annotation["image_id"] = num_images
+                annotation["category_id"] = categories[label]
+                if num_annotations > 1:
+                    annotations_f.write(",")
+                annotations_f.write(
+                    json.dumps(annotation, separators=separators)
+                )
+
+        f.write('],"annotations":[')
+        annotations_f.seek(0)
+        shutil.copyfileobj(annotations_f, f)
+        f.write('],"categories":')
+        json.dump(
+            [
+                {"id": category_id, "name": label, "supercategory": ""}
+                for label, category_id in categories.items()
+            ],
+            f,
+            separators=separators,
+        )
+        f.write("}")
+    os.remove(tmp_annotations_part)
+    os.replace(tmp_annotation_file, annotation_file)
+
+    # Delete images of removed samples and of duplicates
+    exported_names = set(file_names.values())
+    for entry in os.scandir(images_path):
+        if entry.is_file() and entry.name not in exported_names:
+            os.remove(entry.path)
+    logging.info(
+        "Exported %d images, %d annotations, %d categories",
+        num_images,
+        num_annotations,
+        len(categories),
+    )
+
+
+# Output format name -> conversion function
+OUTPUT_FORMATS = {
+    "YOLO": labelme_to_yolo,
+    "YOLO_SEG": functools.partial(labelme_to_yolo, segmentation=True),
+    "YOLO_SHARDS": labelme_to_yolo_shards,
+    "COCO": labelme_to_coco,
+}
 
 
 def main(args):
-    if args.output_format != "YOLO":
-        raise Exception("Only YOLO format is supported now")
+    if args.output_format not in OUTPUT_FORMATS:
+        raise Exception(
+            f"Unsupported output format: {args.output_format}. Supported"
+            f" formats: {', '.join(OUTPUT_FORMATS)}"
+        )
 
     # List of (image_path, label_path)
     train_sets = []
@@ -121,12 +818,16 @@ def main(args):
     # Scan training
     if args.train_path is None:
         raise Exception("At least one `train_path` must be present")
+    # Sample -> split value of its label path relative to the train path
+    split_values = {}
     for path in args.train_path:
-        train_sets += scan_labelme_labels(path)
-    original_train_sets_size = len(train_sets)
-
-    random.seed(42)
-    random.shuffle(train_sets)
+        for sample in scan_labelme_labels(path):
+            train_sets.append(sample)
+            split_values[sample] = split_value(
+                os.path.relpath(sample[1], path)
+            )
+    train_sets.sort()
+    val_ratio = 0
 
     # Scan validation
     if args.val_path is not None and args.split_val_from_train:
@@ -139,9 +840,10 @@ def main(args):
     elif args.split_val_from_train:
         if args.split_val_ratio <= 0 or args.split_val_ratio >= 1:
             raise Exception("Validation ratio must be from 0 to 1")
-        val_size = int(original_train_sets_size * args.split_val_ratio)
-        val_sets = train_sets[: val_size + 1]
-        train_sets = train_sets[val_size + 1 :]
+        val_ratio = args.split_val_ratio
+        val_sets, train_sets = split_samples(
+            train_sets, split_values, 0, val_ratio
+        )
 
     # Scan test
     if args.test_path is not None and args.split_test_from_train:
@@ -154,30 +856,42 @@ def main(args):
     elif args.split_test_from_train:
         if args.split_test_ratio <= 0 or args.split_test_ratio >= 1:
             raise Exception("Test ratio must be from 0 to 1")
-        test_size = int(original_train_sets_size * args.split_test_ratio)
-        if test_size > len(train_sets):
+        if val_ratio + args.split_test_ratio >= 1:
             raise Exception(
-                "Not enough training data to split for both validation and"
-                f" test set. Training size: {original_train_sets_size},"
-                f" expected: > {test_size + len(train_sets)}"
+                "Validation and test ratios must sum to less than 1"
             )
-        test_sets = train_sets[: test_size + 1]
-        train_sets = train_sets[test_size + 1 :]
+        test_sets, train_sets = split_samples(
+            train_sets,
+            split_values,
+            val_ratio,
+            val_ratio + args.split_test_ratio,
+        )
+
+    convert = OUTPUT_FORMATS[args.output_format]
+    convert_options = {
+        "num_workers": getattr(args, "num_workers", None),
+        "transfer_mode": getattr(args, "image_transfer", "copy"),
+    }
+    if args.output_format == "YOLO_SHARDS":
+        convert_options["shard_size"] = int(
+            getattr(args, "shard_size_mb", DEFAULT_SHARD_SIZE // 2**20)
+            * 2**20
+        )
 
     logging.info("Converting training set")
-    labelme_to_yolo(train_sets, args.output_train_path)
+    convert(train_sets, args.output_train_path, **convert_options)
 
     if len(val_sets) == 0:
         logging.warning("Skipped empty validation set")
     else:
         logging.info("Converting validation set")
-        labelme_to_yolo(val_sets, args.output_val_path)
+        convert(val_sets, args.output_val_path, **convert_options)
 
     if len(test_sets) == 0:
         logging.warning("Skipped empty test set")
     else:
         logging.info("Converting test set")
-        labelme_to_yolo(test_sets, args.output_test_path)
+        convert(test_sets, args.output_test_path, **convert_options)
 
     logging.info("Training size: %d", len(train_sets))
     logging.info("Validation size: %d", len(val_sets))
@@ -248,7 +962,29 @@ if __name__ == "__main__":
         "--output_format",
         type=str,
         default="YOLO",
-        help="Output format for training data",
+        choices=list(OUTPUT_FORMATS),
+        help="Output format for training data. YOLO_SHARDS packs YOLO"
+        " samples into tar shards. YOLO_SEG writes polygon labels. COCO"
+        " exports boxes and polygons",
+    )
+    parser.add_argument(
+        "--shard_size_mb",
+        type=float,
+        default=DEFAULT_SHARD_SIZE // 2**20,
+        help="Shard size in MB (YOLO_SHARDS format)",
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        required=False,
+        help="Number of conversion processes. Default: number of CPUs",
+    )
+    parser.add_argument(
+        "--image_transfer",
+        type=str,
+        default="copy",
+        choices=IMAGE_TRANSFER_MODES,
+        help="How images are written: copied, linked or re-encoded",
     )
     parser.add_argument(
         "--report_file",
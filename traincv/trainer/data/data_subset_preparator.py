@@ -3,9 +3,9 @@ Data preparation for data subsets (train/test/val)
 This modules contains utilities for copying, spliting and preparing data subsets.
 """
 
-import json
 import os
-import pathlib
+
+from traincv.trainer.data.folder_index import FolderIndex
 
 
 class DataSubsetPreparator:
@@ -19,11 +19,15 @@ class DataSubsetPreparator:
         """Set split ratio when we need to split one dataset into multiple subsets"""
         self.split_ratio = split_ratio
 
-    def is_valid_data_folder(self, path):
+    def is_valid_data_folder(
+        self, path, progress_callback=None, is_cancelled=None
+    ):
         """Check if the data folder is valid
 
         Return False, error_message when data folder is not valid
         Return True, {"path": path, "image_label_list": image_label_list} otherwise
+        `progress_callback(num_labels)` and `is_cancelled()` are passed to
+        FolderIndex.update
         """
         if not os.path.isdir(path):
             return False, "Not a folder"
@@ -32,25 +36,22 @@ class DataSubsetPreparator:
             if data["path"] == path:
                 return False, "Folder is already in the list"
 
-        label_paths = []
-        for folder, _, files in os.walk(path):
-            for file in files:
-                if file.endswith(".json"):
-                    label_paths.append(os.path.join(folder, file))
-        if len(label_paths) == 0:
+        # Only label files changed since the last visit are parsed
+        folder_index = FolderIndex(path)
+        try:
+            records = folder_index.update(progress_callback, is_cancelled)
+        finally:
+            folder_index.close()
+        if records is None:
+            return False, "Cancelled"
+        if len(records) == 0:
             return False, "Folder contains no label file"
 
-        image_label_list = []
-        for label_path in label_paths:
-            data_root = pathlib.Path(label_path).parent.absolute()
-
-            with open(label_path, "r") as f:
-                data = json.load(f)
-
-            if "imagePath" in data:
-                image_path = os.path.join(data_root, data["imagePath"])
-                image_label_list.append((image_path, label_path))
-
+        image_label_list = [
+            (record.image_path, record.label_path)
+            for record in records
+            if record.image_path is not None
+        ]
         if len(image_label_list) == 0:
             return False, "No valid data in folder"
 
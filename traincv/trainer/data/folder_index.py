@@ -0,0 +1,207 @@
+"""
+Persistent index of labelme files in a data folder
+The index is a SQLite database which records, for each label file, its mtime,
+size, image path, image size and number of shapes. Updating the index only
+parses label files which are new or changed since the last update. Databases
+are stored in the user's cache folder, never in the data folder, which may be
+read-only, shared or under version control.
+"""
+
+import collections
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+
+from traincv.common.dataset_scanner import LABEL_EXTENSION, scan_files
+from traincv.common.image_metadata import (ImageMetadataError,
+                                           read_image_metadata)
+
+INDEX_VERSION = 1
+# Number of scanned label files between two progress callbacks
+PROGRESS_INTERVAL = 500
+# One database per data folder, named after a hash of the folder path
+INDEX_DIR = os.path.join(os.path.expanduser("~"), ".traincv", "folder_index")
+# Seconds to wait for another process or thread updating the same index
+INDEX_TIMEOUT = 60
+
+IndexRecord = collections.namedtuple(
+    "IndexRecord",
+    ["label_path", "image_path", "image_width", "image_height", "num_shapes"],
+)
+
+
+def parse_label_file(label_path):
+    """Return (image_path, image_width, image_height, num_shapes)
+
+    image_path is None when the label file is invalid or has no imagePath.
+    """
+    try:
+        with open(label_path, "r") as f:
+            data = json.load(f)
+    except (OSError, ValueError) as e:
+        logging.warning("Could not read label file %s: %s", label_path, e)
+        return None, None, None, 0
+
+    image_path = data.get("imagePath")
+    image_width = data.get("imageWidth")
+    image_height = data.get("imageHeight")
+    if image_path and (image_width is None or image_height is None):
+        try:
+            metadata = read_image_metadata(
+                os.path.join(os.path.dirname(label_path), image_path)
+            )
+            image_width, image_height = metadata.width, metadata.height
+        except ImageMetadataError:
+            pass
+    return image_path, image_width, image_height, len(data.get("shapes", []))
+
+
+class FolderIndex:
+    """Index of label files in a data folder
+
+    The database is stored in INDEX_DIR, or kept in memory when it cannot
+    be opened. Paths are stored relative to the folder.
+    """
+
+    def __init__(self, folder_path, index_path=None):
+        self.folder_path = os.path.abspath(folder_path)
+        self.connection = None
+        index_path = index_path or self.get_index_path()
+        try:
+            os.makedirs(os.path.dirname(index_path), exist_ok=True)
+            self.connection = sqlite3.connect(
+                index_path, timeout=INDEX_TIMEOUT
+            )
+            self.create_tables()
+        except (OSError, sqlite3.Error) as e:
+            logging.warning(
+                "Could not open folder index %s: %s", index_path, e
+            )
+            self.close()
+        if self.connection is None:
+            logging.warning(
+                "Could not store the index of %s, using memory only",
+                self.folder_path,
+            )
+            self.connection = sqlite3.connect(":memory:")
+            self.create_tables()
+
+    def get_index_path(self):
+        """Return the database path of the folder in INDEX_DIR"""
+        folder_hash = hashlib.blake2b(
+            os.path.normcase(self.folder_path).encode("utf-8"), digest_size=16
+        ).hexdigest()
+        return os.path.join(INDEX_DIR, f"{folder_hash}.sqlite")
+
+    def create_tables(self):
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS meta"
+                " (key TEXT PRIMARY KEY, value TEXT)"
+            )
+            version = self.connection.execute(
+                "SELECT value FROM meta WHERE key = 'version'"
+            ).fetchone()
+            if version is not None and int(version[0]) != INDEX_VERSION:
+                self.connection.execute("DROP TABLE IF EXISTS labels")
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS labels ("
+                " label_path TEXT PRIMARY KEY,"
+                " mtime_ns INTEGER, size INTEGER,"
+                " image_path TEXT, image_width INTEGER, image_height INTEGER,"
+                " num_shapes INTEGER)"
+            )
+            self.connection.execute(
+                "INSERT OR REPLACE INTO meta VALUES ('version', ?)",
+                (str(INDEX_VERSION),),
+            )
+
+    def update(self, progress_callback=None, is_cancelled=None):
+        """Sync the index with the folder and return all IndexRecords
+
+        Only label files whose mtime or size changed are parsed.
+        `progress_callback(num_labels)` is called while scanning. When
+        `is_cancelled()` returns True, files parsed so far are saved and
+        None is returned.
+        """
+        signatures = {
+            row[0]: (row[1], row[2])
+            for row in self.connection.execute(
+                "SELECT label_path, mtime_ns, size FROM labels"
+            )
+        }
+
+        changed_rows = []
+        seen = set()
+        prefix_length = len(os.path.join(self.folder_path, ""))
+        for entry in scan_files(self.folder_path, LABEL_EXTENSION):
+            # Skip files which disappear during the scan
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            relative_path = entry.path[prefix_length:]
+            seen.add(relative_path)
+            if len(seen) % PROGRESS_INTERVAL == 0:
+                if is_cancelled is not None and is_cancelled():
+                    self.save_rows(changed_rows, [])
+                    return None
+                if progress_callback is not None:
+                    progress_callback(len(seen))
+            if signatures.get(relative_path) == (
+                stat.st_mtime_ns,
+                stat.st_size,
+            ):
+                continue
+            changed_rows.append(
+                (relative_path, stat.st_mtime_ns, stat.st_size)
+                + parse_label_file(entry.path)
+            )
+        removed_paths = [
+            (path,) for path in signatures.keys() if path not in seen
+        ]
+
+        self.save_rows(changed_rows, removed_paths)
+        if progress_callback is not None:
+            progress_callback(len(seen))
+        logging.debug(
+            "Indexed %s: %d labels, %d parsed, %d removed",
+            self.folder_path,
+            len(seen),
+            len(changed_rows),
+            len(removed_paths),
+        )
+        return self.records()
+
+    def save_rows(self, changed_rows, removed_paths):
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO labels VALUES (?, ?, ?, ?, ?, ?, ?)",
+                changed_rows,
+            )
+            self.connection.executemany(
+                "DELETE FROM labels WHERE label_path = ?", removed_paths
+            )
+
+    def records(self):
+        """Return IndexRecords with absolute paths, sorted by label path"""
+        records = []
+        for row in self.connection.execute(
+            "SELECT label_path, image_path, image_width, image_height,"
+            " num_shapes FROM labels ORDER BY label_path"
+        ):
+            label_path = os.path.join(self.folder_path, row[0])
+            image_path = None
+            if row[1]:
+                image_path = os.path.normpath(
+                    os.path.join(os.path.dirname(label_path), row[1])
+                )
+            records.append(IndexRecord(label_path, image_path, *row[2:]))
+        return records
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
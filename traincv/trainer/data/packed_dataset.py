@@ -0,0 +1,229 @@
+"""
+Sharded packed dataset format
+Samples are packed into tar shards of about `shard_size` bytes instead of one
+file per image / label. Files of a sample share a key ("<key>.jpg",
+"<key>.txt", "<key>.json"), as in WebDataset, so shards are plain tar files
+which can be streamed in order. An index of member offsets allows reading any
+sample by index through memory mapping.
+
+Layout of a packed dataset folder:
+    shard-00000.tar, shard-00001.tar...
+    index.json: format version, shard names and member extensions
+    index.npy: int64 array (samples, 1 + 2 * extensions) of shard id and
+        (offset, size) of each extension, -1 when missing
+    keys.npy: sample keys
+"""
+
+import glob
+import io
+import json
+import mmap
+import os
+import tarfile
+
+import numpy as np
+
+PACKED_DATASET_VERSION = 1
+INDEX_FILE = "index.json"
+INDEX_ARRAY_FILE = "index.npy"
+KEYS_FILE = "keys.npy"
+SHARD_NAME_FORMAT = "shard-{:05d}.tar"
+DEFAULT_SHARD_SIZE = 256 * 1024 * 1024
+
+
+def split_member_name(name):
+    """Split a member name into (key, extension) at the first dot"""
+    key, _, ext = os.path.basename(name).partition(".")
+    return key, ext
+
+
+class ShardWriter:
+    """Write samples into tar shards and build the index
+
+    Usage:
+        with ShardWriter(output_path) as writer:
+            writer.write(key, [("jpg", image_bytes), ("txt", label_bytes)])
+    """
+
+    def __init__(self, output_path, shard_size=DEFAULT_SHARD_SIZE):
+        self.output_path = output_path
+        self.shard_size = shard_size
+        os.makedirs(output_path, exist_ok=True)
+        # Remove a previous dataset, the new index is written on close
+        index_path = os.path.join(output_path, INDEX_FILE)
+        if os.path.isfile(index_path):
+            os.remove(index_path)
+        for path in glob.glob(os.path.join(output_path, "shard-*.tar")):
+            os.remove(path)
+
+        self.shard_names = []
+        self.extensions = []
+        self.keys = []
+        self.rows = []
+        self.tar = None
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def open_next_shard(self):
+        if self.tar is not None:
+            self.tar.close()
+        shard_name = SHARD_NAME_FORMAT.format(len(self.shard_names))
+        self.shard_names.append(shard_name)
+        self.tar = tarfile.open(
+            os.path.join(self.output_path, shard_name),
+            "w",
+            format=tarfile.USTAR_FORMAT,
+        )
+
+    def write(self, key, members):
+        """Write a sample: `members` is a list of (extension, bytes)"""
+        # Samples are never split across shards
+        if self.tar is None or self.tar.offset >= self.shard_size:
+            self.open_next_shard()
+
+        row = {}
+        for ext, data in members:
+            tar_info = tarfile.TarInfo(f"{key}.{ext}")
+            tar_info.size = len(data)
+            tar_info.mode = 0o644
+            self.tar.addfile(tar_info, io.BytesIO(data))
+            # Member data ends at the current offset, padded to blocks
+            num_blocks = -(-len(data) // tarfile.BLOCKSIZE)
+            offset = self.tar.offset - num_blocks * tarfile.BLOCKSIZE
+            row[ext] = (offset, len(data))
+            if ext not in self.extensions:
+                self.extensions.append(ext)
+        self.keys.append(key)
+        self.rows.append((len(self.shard_names) - 1, row))
+
+    def close(self):
+        """Close the last shard and write the index"""
+        if self.closed:
+            return
+        self.closed = True
+        if self.tar is not None:
+            self.tar.close()
+            self.tar = None
+
+        index = np.full(
+            (len(self.rows), 1 + 2 * len(self.extensions)), -1, dtype=np.int64
+        )
+        for i, (shard_id, row) in enumerate(self.rows):
+            index[i, 0] = shard_id
+            for ext, (offset, size) in row.items():
+                column = 1 + 2 * self.extensions.index(ext)
+                index[i, column : column + 2] = (offset, size)
+        np.save(os.path.join(self.output_path, INDEX_ARRAY_FILE), index)
+        np.save(
+            os.path.join(self.output_path, KEYS_FILE),
+            np.array(self.keys, dtype=str),
+        )
+        # The index file is written last: it marks a complete dataset
+        with open(os.path.join(self.output_path, INDEX_FILE), "w") as f:
+            json.dump(
+                {
+                    "version": PACKED_DATASET_VERSION,
+                    "num_samples": len(self.keys),
+                    "shards": self.shard_names,
+                    "extensions": self.extensions,
+                },
+                f,
+            )
+
+
+def iter_shard(shard_path):
+    """Stream samples of a shard as dicts {"__key__": key, ext: bytes}
+
+    Members are read sequentially, so this does not need the index.
+    """
+    sample = None
+    with tarfile.open(shard_path, "r|") as tar:
+        for member in tar:
+            if not member.isfile():
+                continue
+            key, ext = split_member_name(member.name)
+            if sample is not None and sample["__key__"] != key:
+                yield sample
+                sample = None
+            if sample is None:
+                sample = {"__key__": key}
+            sample[ext] = tar.extractfile(member).read()
+    if sample is not None:
+        yield sample
+
+
+class PackedDatasetReader:
+    """Read a packed dataset by index or sequentially
+
+    Samples are dicts {"__key__": key, extension: bytes}. Random access
+    reads members from memory-mapped shards; iteration streams shards in
+    order.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, INDEX_FILE), "r") as f:
+            meta = json.load(f)
+        if meta.get("version") != PACKED_DATASET_VERSION:
+            raise Exception(
+                f"Unsupported packed dataset version: {meta.get('version')}"
+            )
+        self.shard_names = meta["shards"]
+        self.extensions = meta["extensions"]
+        self.index = np.load(
+            os.path.join(path, INDEX_ARRAY_FILE), mmap_mode="r"
+        )
+        self.keys = np.load(os.path.join(path, KEYS_FILE), mmap_mode="r")
+        self.shard_files = [None] * len(self.shard_names)
+        self.shard_maps = [None] * len(self.shard_names)
+
+    def __len__(self):
+        return len(self.index)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def get_shard_map(self, shard_id):
+        if self.shard_maps[shard_id] is None:
+            f = open(  # pylint: disable=consider-using-with
+                os.path.join(self.path, self.shard_names[shard_id]), "rb"
+            )
+            self.shard_files[shard_id] = f
+            self.shard_maps[shard_id] = mmap.mmap(
+                f.fileno(), 0, access=mmap.ACCESS_READ
+            )
+        return self.shard_maps[shard_id]
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if i < 0 or i >= len(self):
+            raise IndexError(f"Sample index out of range: {i}")
+        row = self.index[i]
+        shard_map = self.get_shard_map(int(row[0]))
+        sample = {"__key__": str(self.keys[i])}
+        for j, ext in enumerate(self.extensions):
+            offset, size = int(row[1 + 2 * j]), int(row[2 + 2 * j])
+            if offset >= 0:
+                sample[ext] = shard_map[offset : offset + size]
+        return sample
+
+    def __iter__(self):
+        for shard_name in self.shard_names:
+            yield from iter_shard(os.path.join(self.path, shard_name))
+
+    def close(self):
+        for i, shard_map in enumerate(self.shard_maps):
+            if shard_map is not None:
+                shard_map.close()
+                self.shard_files[i].close()
+        self.shard_files = [None] * len(self.shard_names)
+        self.shard_maps = [None] * len(self.shard_names)
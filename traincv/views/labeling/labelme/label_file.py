@@ -1,11 +1,23 @@
 import base64
 import contextlib
+import functools
 import io
 import json
+import multiprocessing
+import os
 import os.path as osp
 
+import numpy as np
 import PIL.Image
 
+from traincv.common.compact_label import (COMPACT_LABEL_SUFFIX,
+                                          is_compact_label_file,
+                                          read_compact_image_data,
+                                          read_compact_label,
+                                          write_compact_label)
+from traincv.common.image_metadata import (ImageMetadataError,
+                                           read_image_metadata)
+
 from . import __version__, utils
 from .logger import logger
 
@@ -16,7 +28,8 @@ PIL.Image.MAX_IMAGE_PIXELS = None
 def io_open(name, mode):
     assert mode in ["r", "w"]
     encoding = "utf-8"
-    yield io.open(name, mode, encoding=encoding)
+    with io.open(name, mode, encoding=encoding) as f:
+        yield f
 
 
 class LabelFileError(Exception):
@@ -26,20 +39,89 @@ class LabelFileError(Exception):
 class LabelFile:
 
     suffix = ".json"
+    # Optional binary format, see traincv.common.compact_label
+    compact_suffix = COMPACT_LABEL_SUFFIX
+
+    def __init__(self, filename=None, lazy=False):
+        """Load a label file
 
-    def __init__(self, filename=None):
+        With `lazy`, only shapes, flags and image sizes are read from the
+        file. The image is read on the first access to image_data or image.
+        """
         self.shapes = []
         self.image_path = None
         self.image_data = None
+        self.image_height = None
+        self.image_width = None
         if filename is not None:
-            self.load(filename)
+            self.load(filename, lazy=lazy)
         self.filename = filename
 
+    @property
+    def image_data(self):
+        if self._image_data is None and self._image_source is not None:
+            image_data = self._image_source()
+            self._image_source = None
+            self._image = None
+            if image_data is not None:
+                self._check_image_height_and_width(
+                    image_data, self.image_height, self.image_width
+                )
+            self._image_data = image_data
+        return self._image_data
+
+    @image_data.setter
+    def image_data(self, value):
+        self._image_data = value
+        self._image_source = None
+        self._image = None
+
+    @property
+    def image(self):
+        """Image pixels as a numpy array, decoded on first access"""
+        if self._image is None and self.image_data is not None:
+            self._image = utils.img_data_to_arr(self.image_data)
+        return self._image
+
+    def get_shape_points(self):
+        """Return the points of each shape as a float (N, 2) numpy array"""
+        return [
+            np.asarray(shape["points"], dtype=np.float64).reshape(-1, 2)
+            for shape in self.shapes
+        ]
+
+    @staticmethod
+    def load_many(filenames, workers=None):
+        """Load label files lazily, in parallel processes
+
+        Return LabelFiles in the order of `filenames`, with None for files
+        which could not be loaded. Images are not read.
+        """
+        filenames = list(filenames)
+        if workers is None:
+            workers = os.cpu_count()
+        if workers <= 1 or len(filenames) < 2:
+            return [load_label_file_task(f) for f in filenames]
+        chunk_size = max(1, min(256, len(filenames) // (workers * 4)))
+        with multiprocessing.Pool(processes=workers) as pool:
+            return pool.map(
+                load_label_file_task, filenames, chunksize=chunk_size
+            )
+
     @staticmethod
     def load_image_file(filename):
         try:
+            metadata = read_image_metadata(filename)
+            # Files which need no conversion are returned as they are,
+            # so the image is decoded only once, by the viewer
+            if metadata.orientation == 1 and (
+                metadata.format == "PNG"
+                or (metadata.format == "JPEG" and metadata.channels in (1, 3))
+            ):
+                with open(filename, "rb") as f:
+                    return f.read()
             image_pil = PIL.Image.open(filename)
-        except IOError:
+        except (IOError, ImageMetadataError):
             logger.error("Failed opening image file: %s", filename)
             return None
 
@@ -57,7 +139,7 @@ class LabelFile:
             f.seek(0)
             return f.read()
 
-    def load(self, filename):
+    def load(self, filename, lazy=False):
         keys = [
             "version",
             "imageData",
@@ -76,8 +158,14 @@ class LabelFile:
             "flags",
         ]
         try:
-            with io_open(filename, "r") as f:
-                data = json.load(f)
+            image_location = None
+            if is_compact_label_file(filename):
+                data, image_location = read_compact_label(
+                    filename, read_image_data=False
+                )
+            else:
+                with io_open(filename, "r") as f:
+                    data = json.load(f)
             version = data.get("version")
             if version is None:
                 logger.warning(
@@ -95,19 +183,30 @@ class LabelFile:
                     __version__,
                 )
 
-            if data["imageData"] is not None:
-                image_data = base64.b64decode(data["imageData"])
+            if image_location is not None:
+                image_source = functools.partial(
+                    read_compact_image_data, filename, *image_location
+                )
+            elif data["imageData"] is not None:
+                image_source = functools.partial(
+                    base64.b64decode, data["imageData"]
+                )
             else:
                 # relative path from label file to relative path from cwd
-                image_path = osp.join(osp.dirname(filename), data["imagePath"])
-                image_data = self.load_image_file(image_path)
+                image_source = functools.partial(
+                    self.load_image_file,
+                    osp.join(osp.dirname(filename), data["imagePath"]),
+                )
+            image_data = None
+            if not lazy:
+                image_data = image_source()
+                self._check_image_height_and_width(
+                    image_data,
+                    data.get("imageHeight"),
+                    data.get("imageWidth"),
+                )
             flags = data.get("flags") or {}
             image_path = data["imagePath"]
-            self._check_image_height_and_width(
-                base64.b64encode(image_data).decode("utf-8"),
-                data.get("imageHeight"),
-                data.get("imageWidth"),
-            )
             shapes = [
                 dict(
                     label=s["label"],
@@ -137,25 +236,30 @@ class LabelFile:
         self.flags = flags
         self.shapes = shapes
         self.image_path = image_path
+        self.image_height = data.get("imageHeight")
+        self.image_width = data.get("imageWidth")
         self.image_data = image_data
+        if lazy:
+            self._image_source = image_source
         self.filename = filename
         self.other_data = other_data
 
     @staticmethod
     def _check_image_height_and_width(image_data, image_height, image_width):
-        img_arr = utils.img_b64_to_arr(image_data)
-        if image_height is not None and img_arr.shape[0] != image_height:
+        # Only the image header is read, pixels are not decoded
+        metadata = read_image_metadata(image_data)
+        if image_height is not None and metadata.height != image_height:
             logger.error(
                 "image_height does not match with image_data or image_path, "
                 "so getting image_height from actual image."
             )
-            image_height = img_arr.shape[0]
-        if image_width is not None and img_arr.shape[1] != image_width:
+            image_height = metadata.height
+        if image_width is not None and metadata.width != image_width:
             logger.error(
                 "image_width does not match with image_data or image_path, "
                 "so getting image_width from actual image."
             )
-            image_width = img_arr.shape[1]
+            image_width = metadata.width
         return image_height, image_width
 
     def save(
@@ -170,10 +274,15 @@ class LabelFile:
         flags=None,
     ):
         if image_data is not None:
+            try:
+                image_height, image_width = self._check_image_height_and_width(
+                    image_data, image_height, image_width
+                )
+            except Exception as e:
+                raise LabelFileError(e) from e
+        compact = is_compact_label_file(filename)
+        if image_data is not None and not compact:
             image_data = base64.b64encode(image_data).decode("utf-8")
-            image_height, image_width = self._check_image_height_and_width(
-                image_data, image_height, image_width
-            )
         if other_data is None:
             other_data = {}
         if flags is None:
@@ -191,12 +300,46 @@ class LabelFile:
             assert key not in data
             data[key] = value
         try:
-            with io_open(filename, "w") as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            # Replace the file only when it is completely written
+            tmp_filename = f"{filename}.tmp"
+            if compact:
+                write_compact_label(tmp_filename, data)
+            else:
+                with io_open(tmp_filename, "w") as f:
+                    json.dump(data, f, ensure_ascii=False, indent=2)
+            os.replace(tmp_filename, filename)
             self.filename = filename
         except Exception as e:
             raise LabelFileError(e) from e
 
     @staticmethod
     def is_label_file(filename):
-        return osp.splitext(filename)[1].lower() == LabelFile.suffix
+        return osp.splitext(filename)[1].lower() in (
+            LabelFile.suffix,
+            LabelFile.compact_suffix,
+        )
+
+    @staticmethod
+    def find_label_file(label_file):
+        """Return the label file to use for a JSON label file path
+
+        The compact label file with the same stem is returned when only
+        that one exists, so that it is loaded and saved in its format.
+        """
+        if osp.exists(label_file):
+            return label_file
+        compact_label_file = (
+            osp.splitext(label_file)[0] + LabelFile.compact_suffix
+        )
+        if osp.exists(compact_label_file):
+            return compact_label_file
+        return label_file
+
+
+def load_label_file_task(filename):
+    """Load a label file lazily, return None on error"""
+    try:
+        return LabelFile(filename, lazy=True)
+    except LabelFileError as e:
+        logger.error("Failed loading label file %s: %s", filename, e)
+        return None
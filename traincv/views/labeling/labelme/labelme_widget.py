@@ -6,6 +6,7 @@ import math
 import os
 import os.path as osp
 import re
+import time
 import webbrowser
 
 import imgviz
@@ -13,9 +14,12 @@ import natsort
 from PyQt5 import QtCore, QtGui, QtWidgets
 from PyQt5.QtCore import Qt
 from PyQt5.QtWidgets import (QDockWidget, QHBoxLayout, QLabel, QMessageBox,
-                             QPlainTextEdit, QVBoxLayout, QWhatsThis)
+                             QPlainTextEdit, QProgressBar, QPushButton,
+                             QVBoxLayout, QWhatsThis)
 
-from traincv.services.yolov5 import YOLOv5Predictor
+from traincv.common.dataset_scanner import list_file_names, scan_dataset
+from traincv.services.ai_model_worker import AIModelWorker
+from traincv.services.label_writer import LabelWriter
 
 from . import __appname__, utils
 from .config import get_config
@@ -24,8 +28,9 @@ from .logger import logger
 from .shape import Shape
 from .tracker import Tracker
 from .widgets import (BrightnessContrastDialog, Canvas, FileDialogPreview,
-                      LabelDialog, LabelListWidget, LabelListWidgetItem,
-                      ToolBar, UniqueLabelQListWidget, ZoomWidget)
+                      FileListModel, LabelDialog, LabelListWidget,
+                      LabelListWidgetItem, ToolBar, UniqueLabelQListWidget,
+                      ZoomWidget)
 
 LABEL_COLORMAP = imgviz.label_colormap()
 
@@ -33,6 +38,9 @@ LABEL_COLORMAP = imgviz.label_colormap()
 LABEL_COLORMAP[2] = LABEL_COLORMAP[1]
 LABEL_COLORMAP[1] = [0, 180, 33]
 
+# Seconds between two updates of the file list while scanning a folder
+SCAN_UPDATE_INTERVAL = 0.5
+
 
 class LabelmeWidget(LabelDialog):
     """Labelme widget"""
@@ -66,7 +74,19 @@ class LabelmeWidget(LabelDialog):
         self.tracker = Tracker()
 
         # AI models for auto labeling
+        # Loading and prediction run on a background worker,
+        # `ai_model` is the config path of the loaded model
         self.ai_model = None
+        self.ai_request_id = 0
+        self.ai_worker = AIModelWorker()
+        self.ai_worker.progress.connect(self.ai_progress)
+        self.ai_worker.model_loaded.connect(self.ai_model_loaded)
+        self.ai_worker.shapes_predicted.connect(self.ai_shapes_predicted)
+        self.ai_worker.failed.connect(self.ai_failed)
+
+        # Auto-saved labels are written on a background thread
+        self.label_writer = LabelWriter()
+        self.label_writer.failed.connect(self.label_save_failed)
 
         # see configs/labelme_config.yaml for valid configuration
         if config is None:
@@ -154,15 +174,36 @@ class LabelmeWidget(LabelDialog):
         self.file_search = QtWidgets.QLineEdit()
         self.file_search.setPlaceholderText(self.tr("Search Filename"))
         self.file_search.textChanged.connect(self.file_search_changed)
-        self.file_list_widget = QtWidgets.QListWidget()
-        self.file_list_widget.itemSelectionChanged.connect(
+        # A table view with fixed row heights only queries the model for
+        # visible rows, while list views lay out every row on each change
+        self.file_list_model = FileListModel(self.get_image_label_file, self)
+        self.file_list_view = QtWidgets.QTableView()
+        self.file_list_view.setModel(self.file_list_model)
+        self.file_list_view.setShowGrid(False)
+        self.file_list_view.setSelectionBehavior(
+            QtWidgets.QAbstractItemView.SelectRows
+        )
+        self.file_list_view.setSelectionMode(
+            QtWidgets.QAbstractItemView.SingleSelection
+        )
+        self.file_list_view.setTextElideMode(Qt.ElideLeft)
+        self.file_list_view.horizontalHeader().hide()
+        self.file_list_view.horizontalHeader().setStretchLastSection(True)
+        self.file_list_view.verticalHeader().hide()
+        self.file_list_view.verticalHeader().setSectionResizeMode(
+            QtWidgets.QHeaderView.Fixed
+        )
+        self.file_list_view.verticalHeader().setDefaultSectionSize(
+            self.file_list_view.fontMetrics().height() + 6
+        )
+        self.file_list_view.selectionModel().selectionChanged.connect(
             self.file_selection_changed
         )
         file_list_layout = QtWidgets.QVBoxLayout()
         file_list_layout.setContentsMargins(0, 0, 0, 0)
         file_list_layout.setSpacing(0)
         file_list_layout.addWidget(self.file_search)
-        file_list_layout.addWidget(self.file_list_widget)
+        file_list_layout.addWidget(self.file_list_view)
         self.file_dock = QtWidgets.QDockWidget(self.tr("File List"), self)
         self.file_dock.setObjectName("Files")
         file_list_widget = QtWidgets.QWidget()
@@ -841,6 +882,24 @@ class LabelmeWidget(LabelDialog):
         )
         label_instruction.setContentsMargins(0, 10, 0, 10)
         central_layout.addWidget(label_instruction)
+
+        # AI progress (hidden when no AI job is running)
+        self.ai_status_label = QLabel()
+        self.ai_progress_bar = QProgressBar()
+        self.ai_progress_bar.setRange(0, 0)
+        self.ai_progress_bar.setMaximumHeight(12)
+        self.ai_progress_bar.setTextVisible(False)
+        self.ai_cancel_button = QPushButton(self.tr("Cancel"))
+        self.ai_cancel_button.clicked.connect(self.ai_cancel)
+        ai_progress_layout = QHBoxLayout()
+        ai_progress_layout.setContentsMargins(0, 0, 0, 5)
+        ai_progress_layout.addWidget(self.ai_status_label)
+        ai_progress_layout.addWidget(self.ai_progress_bar)
+        ai_progress_layout.addWidget(self.ai_cancel_button)
+        self.ai_progress_widget = QtWidgets.QWidget()
+        self.ai_progress_widget.setLayout(ai_progress_layout)
+        self.ai_progress_widget.hide()
+        central_layout.addWidget(self.ai_progress_widget)
         central_layout.addWidget(scroll_area)
         layout.addItem(central_layout)
 
@@ -1002,7 +1061,9 @@ class LabelmeWidget(LabelDialog):
             if self.output_dir:
                 label_file_without_path = osp.basename(label_file)
                 label_file = osp.join(self.output_dir, label_file_without_path)
-            self.save_labels(label_file)
+            # Keep the format of an existing compact label file
+            label_file = LabelFile.find_label_file(label_file)
+            self.save_labels(label_file, background=True)
             return
         self.dirty = True
         self.actions.save.setEnabled(True)
@@ -1234,19 +1295,21 @@ class LabelmeWidget(LabelDialog):
         )
 
     def file_selection_changed(self):
-        items = self.file_list_widget.selectedItems()
-        if not items:
+        indexes = self.file_list_view.selectionModel().selectedIndexes()
+        if not indexes:
             return
-        item = items[0]
 
         if not self.may_continue():
             return
 
-        current_index = self.image_list.index(str(item.text()))
-        if current_index < len(self.image_list):
-            filename = self.image_list[current_index]
-            if filename:
-                self.load_file(filename)
+        filename = self.image_list[indexes[0].row()]
+        if filename:
+            self.load_file(filename)
+
+    def set_current_file_row(self, row):
+        """Select a row of the file list, which loads its file"""
+        self.file_list_view.setCurrentIndex(self.file_list_model.index(row))
+        self.file_list_view.repaint()
 
     # React to canvas signals.
     def shape_selection_changed(self, selected_shapes):
@@ -1396,7 +1459,12 @@ class LabelmeWidget(LabelDialog):
             item.setCheckState(Qt.Checked if flag else Qt.Unchecked)
             self.flag_widget.addItem(item)
 
-    def save_labels(self, filename):
+    def save_labels(self, filename, background=False):
+        """Save labels of the current image
+
+        With `background`, the file is written later by the label writer
+        and errors are reported by label_save_failed.
+        """
         label_file = LabelFile()
 
         def format_shape(s):
@@ -1427,24 +1495,24 @@ class LabelmeWidget(LabelDialog):
             )
             if osp.dirname(filename) and not osp.exists(osp.dirname(filename)):
                 os.makedirs(osp.dirname(filename))
-            label_file.save(
-                filename=filename,
+            save_args = dict(
                 shapes=shapes,
                 image_path=image_path,
                 image_data=image_data,
                 image_height=self.image.height(),
                 image_width=self.image.width(),
-                other_data=self.other_data,
+                other_data=self.other_data.copy(),
                 flags=flags,
             )
+            if background:
+                self.label_writer.save(filename, **save_args)
+                label_file.filename = filename
+            else:
+                # Pending auto-saves must not overwrite this file later
+                self.label_writer.flush()
+                label_file.save(filename=filename, **save_args)
             self.label_file = label_file
-            items = self.file_list_widget.findItems(
-                self.image_path, Qt.MatchExactly
-            )
-            if len(items) > 0:
-                if len(items) != 1:
-                    raise RuntimeError("There are duplicate files.")
-                items[0].setCheckState(Qt.Checked)
+            self.file_list_model.set_labeled(self.image_path, True)
             # disable allows next and previous image to proceed
             # self.filename = filename
             return True
@@ -1454,6 +1522,12 @@ class LabelmeWidget(LabelDialog):
             )
             return False
 
+    def label_save_failed(self, filename, message):
+        self.error_message(
+            self.tr("Error saving label data"),
+            self.tr("<b>%s</b>") % f"{filename}: {message}",
+        )
+
     def duplicate_selected_shape(self):
         added_shapes = self.canvas.duplicate_selected_shapes()
         self.label_list.clearSelection()
@@ -1642,17 +1716,14 @@ class LabelmeWidget(LabelDialog):
         # Update tracker
         self.tracker.update(self.canvas.shapes, self.image)
 
-        # Changing file_list_widget loads file
-        if filename in self.image_list and (
-            self.file_list_widget.currentRow()
-            != self.image_list.index(filename)
-        ):
-            self.file_list_widget.setCurrentRow(
-                self.image_list.index(filename)
-            )
-            self.file_list_widget.repaint()
+        # Changing the current row of file_list_view loads file
+        row = self.file_list_model.find_row(filename)
+        if row >= 0 and self.file_list_view.currentIndex().row() != row:
+            self.set_current_file_row(row)
             return False
 
+        # Label files must be read after pending auto-saves
+        self.label_writer.flush()
         self.reset_state()
         self.canvas.setEnabled(False)
         if filename is None:
@@ -1665,14 +1736,20 @@ class LabelmeWidget(LabelDialog):
             )
             return False
 
-        # assumes same name, but json extension
+        # assumes same name, but json extension, or the compact label
+        # extension when only that file exists
         self.status(
             str(self.tr("Loading %s...")) % osp.basename(str(filename))
         )
-        label_file = osp.splitext(filename)[0] + ".json"
+        if LabelFile.is_label_file(filename):
+            label_file = filename
+        else:
+            label_file = osp.splitext(filename)[0] + ".json"
         if self.output_dir:
             label_file_without_path = osp.basename(label_file)
             label_file = osp.join(self.output_dir, label_file_without_path)
+        if not LabelFile.is_label_file(filename):
+            label_file = LabelFile.find_label_file(label_file)
         if QtCore.QFile.exists(label_file) and LabelFile.is_label_file(
             label_file
         ):
@@ -1780,6 +1857,7 @@ class LabelmeWidget(LabelDialog):
         self.toggle_actions(True)
         self.canvas.setFocus()
         self.status(str(self.tr("Loaded %s")) % osp.basename(str(filename)))
+        self.ai_schedule_prefetch()
         return True
 
     # QT Overload
@@ -1828,6 +1906,7 @@ class LabelmeWidget(LabelDialog):
     def closeEvent(self, event):
         if not self.may_continue():
             event.ignore()
+        self.label_writer.flush()
         self.settings.setValue(
             "filename", self.filename if self.filename else ""
         )
@@ -1881,7 +1960,7 @@ class LabelmeWidget(LabelDialog):
         if self.filename is None:
             return
 
-        current_index = self.image_list.index(self.filename)
+        current_index = self.file_list_model.find_row(self.filename)
         if current_index - 1 >= 0:
             filename = self.image_list[current_index - 1]
             if filename:
@@ -1906,7 +1985,7 @@ class LabelmeWidget(LabelDialog):
         if self.filename is None:
             filename = self.image_list[0]
         else:
-            current_index = self.image_list.index(self.filename)
+            current_index = self.file_list_model.find_row(self.filename)
             if current_index + 1 < len(self.image_list):
                 filename = self.image_list[current_index + 1]
             else:
@@ -1927,7 +2006,7 @@ class LabelmeWidget(LabelDialog):
             for fmt in QtGui.QImageReader.supportedImageFormats()
         ]
         filters = self.tr("Image & Label files (%s)") % " ".join(
-            formats + [f"*{LabelFile.suffix}"]
+            formats + [f"*{LabelFile.suffix}", f"*{LabelFile.compact_suffix}"]
         )
         file_dialog = FileDialogPreview(self)
         file_dialog.setFileMode(FileDialogPreview.ExistingFile)
@@ -1972,12 +2051,10 @@ class LabelmeWidget(LabelDialog):
         current_filename = self.filename
         self.import_image_folder(self.last_open_dir, load=False)
 
-        if current_filename in self.image_list:
+        row = self.file_list_model.find_row(current_filename)
+        if row >= 0:
             # retain currently selected file
-            self.file_list_widget.setCurrentRow(
-                self.image_list.index(current_filename)
-            )
-            self.file_list_widget.repaint()
+            self.set_current_file_row(row)
 
     def save_file(self, _value=False):
         assert not self.image.isNull(), "cannot save empty image"
@@ -2045,10 +2122,12 @@ class LabelmeWidget(LabelDialog):
         self.actions.save_as.setEnabled(False)
 
     def get_label_file(self):
-        if self.filename.lower().endswith(".json"):
+        if LabelFile.is_label_file(self.filename):
             label_file = self.filename
         else:
-            label_file = osp.splitext(self.filename)[0] + ".json"
+            label_file = LabelFile.find_label_file(
+                osp.splitext(self.filename)[0] + ".json"
+            )
 
         return label_file
 
@@ -2063,12 +2142,12 @@ class LabelmeWidget(LabelDialog):
             return
 
         label_file = self.get_label_file()
+        self.label_writer.flush()
         if osp.exists(label_file):
             os.remove(label_file)
             logger.info("Label file is removed: %s", label_file)
 
-            item = self.file_list_widget.currentItem()
-            item.setCheckState(Qt.Unchecked)
+            self.file_list_model.set_labeled(self.filename, False)
 
             self.reset_state()
 
@@ -2181,11 +2260,18 @@ class LabelmeWidget(LabelDialog):
 
     @property
     def image_list(self):
-        lst = []
-        for i in range(self.file_list_widget.count()):
-            item = self.file_list_widget.item(i)
-            lst.append(item.text())
-        return lst
+        """Image paths of the file list. Do not modify."""
+        return self.file_list_model.paths
+
+    def get_image_label_file(self, filename):
+        """Return the label file path of an image
+
+        The JSON path is returned unless only a compact label file exists.
+        """
+        label_file = osp.splitext(filename)[0] + LabelFile.suffix
+        if self.output_dir:
+            label_file = osp.join(self.output_dir, osp.basename(label_file))
+        return LabelFile.find_label_file(label_file)
 
     def import_dropped_image_files(self, image_files):
         extensions = [
@@ -2194,24 +2280,14 @@ class LabelmeWidget(LabelDialog):
         ]
 
         self.filename = None
-        for file in image_files:
-            if file in self.image_list or not file.lower().endswith(
-                tuple(extensions)
-            ):
-                continue
-            label_file = osp.splitext(file)[0] + ".json"
-            if self.output_dir:
-                label_file_without_path = osp.basename(label_file)
-                label_file = osp.join(self.output_dir, label_file_without_path)
-            item = QtWidgets.QListWidgetItem(file)
-            item.setFlags(Qt.ItemIsEnabled | Qt.ItemIsSelectable)
-            if QtCore.QFile.exists(label_file) and LabelFile.is_label_file(
-                label_file
-            ):
-                item.setCheckState(Qt.Checked)
-            else:
-                item.setCheckState(Qt.Unchecked)
-            self.file_list_widget.addItem(item)
+        # Label files are checked when rows are shown
+        self.file_list_model.add_paths(
+            [
+                file
+                for file in image_files
+                if file.lower().endswith(tuple(extensions))
+            ]
+        )
 
         if len(self.image_list) > 1:
             self.actions.open_next_image.setEnabled(True)
@@ -2228,39 +2304,52 @@ class LabelmeWidget(LabelDialog):
 
         self.last_open_dir = dirpath
         self.filename = None
-        self.file_list_widget.clear()
-        for filename in self.scan_all_images(dirpath):
+        self.file_list_model.clear()
+        output_label_names = None
+        if self.output_dir:
+            output_label_names = list_file_names(
+                self.output_dir, (LabelFile.suffix, LabelFile.compact_suffix)
+            )
+        # Label status comes from the folder listings, files are not stat-ed
+        paths = []
+        labeled = []
+        last_update = time.monotonic()
+        for filename, label_file in self.scan_all_images(dirpath):
             if pattern and pattern not in filename:
                 continue
-            label_file = osp.splitext(filename)[0] + ".json"
             if self.output_dir:
-                label_file_without_path = osp.basename(label_file)
-                label_file = osp.join(self.output_dir, label_file_without_path)
-            item = QtWidgets.QListWidgetItem(filename)
-            item.setFlags(Qt.ItemIsEnabled | Qt.ItemIsSelectable)
-            if QtCore.QFile.exists(label_file) and LabelFile.is_label_file(
-                label_file
-            ):
-                item.setCheckState(Qt.Checked)
+                stem = osp.splitext(osp.basename(filename))[0]
+                labeled.append(
+                    stem + LabelFile.suffix in output_label_names
+                    or stem + LabelFile.compact_suffix in output_label_names
+                )
             else:
-                item.setCheckState(Qt.Unchecked)
-            self.file_list_widget.addItem(item)
+                labeled.append(label_file is not None)
+            paths.append(filename)
+            # Show the list progressively on large folders
+            if time.monotonic() - last_update >= SCAN_UPDATE_INTERVAL:
+                self.file_list_model.add_paths(paths, labeled)
+                paths = []
+                labeled = []
+                QtWidgets.QApplication.processEvents(
+                    QtCore.QEventLoop.ExcludeUserInputEvents
+                )
+                last_update = time.monotonic()
+        self.file_list_model.add_paths(paths, labeled)
         self.open_next_image(load=load)
 
     def scan_all_images(self, folder_path):
+        """Yield (image_path, label_path or None) in natural sort order"""
         extensions = [
             f".{fmt.data().decode().lower()}"
             for fmt in QtGui.QImageReader.supportedImageFormats()
         ]
-
-        images = []
-        for root, _, files in os.walk(folder_path):
-            for file in files:
-                if file.lower().endswith(tuple(extensions)):
-                    relative_path = osp.join(root, file)
-                    images.append(relative_path)
-        images = natsort.os_sorted(images)
-        return images
+        yield from scan_dataset(
+            folder_path,
+            image_extensions=extensions,
+            label_extension=(LabelFile.suffix, LabelFile.compact_suffix),
+            sort_key=natsort.os_sort_keygen(),
+        )
 
     def track(self):
         QMessageBox.warning(self, "Warning", "Tracking is not supported now.")
@@ -2269,22 +2358,18 @@ class LabelmeWidget(LabelDialog):
         # self.set_dirty()
 
     def ai_load_model(self):
-        """Load AI model from disk."""
+        """Load AI model from disk in the background."""
         file_path = QtWidgets.QFileDialog.getOpenFileName(
             self, "Select AI Model Config", ".", "Model config file (*.yaml)"
         )
         if not file_path[0]:
             return
         file_path = file_path[0]
-        try:
-            self.ai_model = YOLOv5Predictor(file_path)
-        except Exception as e:
-            QMessageBox.warning(self, "Error", f"Failed to load AI model: {e}")
-            return
-        self.statusBar().showMessage(f"AI Model loaded from {file_path}", 5000)
+        self.ai_start_request()
+        self.ai_worker.load_requested.emit(self.ai_request_id, file_path)
 
     def ai_predict(self):
-        """Predict shapes using AI model"""
+        """Predict shapes using AI model in the background"""
         if self.image_path is None:
             QMessageBox.warning(self, "Warning", "Please load images first.")
             return
@@ -2296,6 +2381,69 @@ class LabelmeWidget(LabelDialog):
             )
             return
 
-        shapes = self.ai_model.predict_shapes(self.image)
+        # Use prefetched predictions when available
+        shapes = self.ai_worker.get_cached_shapes(self.filename)
+        if shapes is not None:
+            self.load_shapes(shapes, replace=True)
+            self.set_dirty()
+            return
+
+        self.ai_start_request()
+        self.ai_worker.predict_requested.emit(
+            self.ai_request_id, self.filename, self.image
+        )
+
+    def ai_schedule_prefetch(self):
+        """Prefetch predictions of the next images in the file list"""
+        count = self._config["ai_prefetch_count"]
+        if self.ai_model is None or not count or self.filename is None:
+            return
+        index = self.file_list_model.find_row(self.filename)
+        if index < 0:
+            return
+        self.ai_worker.set_prefetch_paths(
+            self.image_list[index + 1 : index + 1 + count]
+        )
+
+    def ai_start_request(self):
+        """Cancel the running AI job and start a new one"""
+        self.ai_worker.cancel(self.ai_request_id)
+        self.ai_request_id += 1
+        self.ai_status_label.setText("")
+        self.ai_progress_widget.show()
+
+    def ai_finish_request(self):
+        self.ai_progress_widget.hide()
+
+    def ai_cancel(self):
+        self.ai_worker.cancel(self.ai_request_id)
+        self.ai_finish_request()
+        self.status(self.tr("AI job cancelled"))
+
+    def ai_progress(self, request_id, message):
+        if request_id == self.ai_request_id:
+            self.ai_status_label.setText(message)
+
+    def ai_model_loaded(self, request_id, file_path):
+        self.ai_model = file_path
+        self.ai_schedule_prefetch()
+        if request_id != self.ai_request_id:
+            return
+        self.ai_finish_request()
+        self.status(f"AI Model loaded from {file_path}")
+
+    def ai_shapes_predicted(self, request_id, filename, shapes):
+        if request_id != self.ai_request_id:
+            return
+        self.ai_finish_request()
+        # Ignore results of an image which is not opened anymore
+        if filename != self.filename:
+            return
         self.load_shapes(shapes, replace=True)
         self.set_dirty()
+
+    def ai_failed(self, request_id, message):
+        if request_id != self.ai_request_id:
+            return
+        self.ai_finish_request()
+        QMessageBox.warning(self, "Error", message)
@@ -0,0 +1,91 @@
+import os.path as osp
+
+from PyQt5 import QtCore
+from PyQt5.QtCore import Qt
+
+
+class FileListModel(QtCore.QAbstractListModel):
+    """List of image paths with their label status
+
+    Paths are stored in a list with a dict of path -> row, so lookups do
+    not scan the list. The label status of a row is checked when the view
+    first shows it, unless it is given when paths are added.
+    """
+
+    def __init__(self, get_label_file, parent=None):
+        super().__init__(parent)
+        # Return the label file path of an image path
+        self.get_label_file = get_label_file
+        self.paths = []
+        self.rows = {}
+        # True / False, or None when not checked yet
+        self.labeled = []
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.paths)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row = index.row()
+        if role == Qt.DisplayRole:
+            return self.paths[row]
+        if role == Qt.CheckStateRole:
+            if self.labeled[row] is None:
+                self.labeled[row] = osp.exists(
+                    self.get_label_file(self.paths[row])
+                )
+            return Qt.Checked if self.labeled[row] else Qt.Unchecked
+        return None
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.NoItemFlags
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable
+
+    def clear(self):
+        self.beginResetModel()
+        self.paths = []
+        self.rows = {}
+        self.labeled = []
+        self.endResetModel()
+
+    def add_paths(self, paths, labeled=None):
+        """Append paths which are not in the list yet
+
+        `labeled` gives the label status of each path, None to check it
+        later.
+        """
+        if labeled is None:
+            labeled = [None] * len(paths)
+        first_row = len(self.paths)
+        new_paths = []
+        new_labeled = []
+        for path, is_labeled in zip(paths, labeled):
+            if path in self.rows:
+                continue
+            self.rows[path] = first_row + len(new_paths)
+            new_paths.append(path)
+            new_labeled.append(is_labeled)
+        if not new_paths:
+            return
+        self.beginInsertRows(
+            QtCore.QModelIndex(), first_row, first_row + len(new_paths) - 1
+        )
+        self.paths.extend(new_paths)
+        self.labeled.extend(new_labeled)
+        self.endInsertRows()
+
+    def find_row(self, path):
+        """Return the row of a path, -1 if it is not in the list"""
+        return self.rows.get(path, -1)
+
+    def set_labeled(self, path, labeled):
+        row = self.find_row(path)
+        if row < 0:
+            return
+        self.labeled[row] = labeled
+        index = self.index(row)
+        self.dataChanged.emit(index, index, [Qt.CheckStateRole])
@@ -5,6 +5,7 @@ from PyQt5 import QtCore, uic
 from PyQt5.QtWidgets import QFileDialog, QHeaderView, QWidget
 
 from traincv.models.tablemodel import TableModel
+from traincv.services.folder_validator import FolderValidator
 from traincv.trainer.data.data_subset_preparator import DataSubsetPreparator
 from traincv.views.common.toaster import QToaster
 
@@ -70,6 +71,15 @@ class DataSubsetTable(QWidget):
 
         self.data_preparator = DataSubsetPreparator()
 
+        # Folders are validated in the background. Folders being validated
+        # are shown after the added folders: task id -> (path, num labels)
+        self.pending_folders = {}
+        self.folder_validator = FolderValidator(self.data_preparator)
+        self.folder_validator.progress.connect(self.on_folder_progress)
+        self.folder_validator.finished.connect(self.on_folder_validated)
+        self.cancel_scan_button.clicked.connect(self.cancel_scan)
+        self.cancel_scan_button.hide()
+
     def slider_disconnect(self):
         self.split_ratio_slider.valueChanged.disconnect()
 
@@ -96,32 +106,87 @@ class DataSubsetTable(QWidget):
         self.data_sources_table.setModel(self.model)
 
     def verify_and_add_items(self, links):
+        pending_paths = [path for path, _ in self.pending_folders.values()]
         for link in links:
-            ret, message = self.data_preparator.is_valid_data_folder(link)
-            if ret:
-                self.model.addRow({DataSubsetTable.DATA_FOLDER_TITLE: link})
-                data = message
-                self.data_preparator.add_data_folder(data)
-            else:
-                corner = QtCore.Qt.Corner(QtCore.Qt.BottomRightCorner)
-                QToaster.show_message(
-                    self,
-                    f"{message}: {link}",
-                    corner=corner,
-                    timeout=3000,
-                    closable=True,
-                )
+            if link in pending_paths:
+                self.show_message(f"Folder is already being scanned: {link}")
+                continue
+            task_id = self.folder_validator.validate(link)
+            self.pending_folders[task_id] = (link, 0)
+            pending_paths.append(link)
+        self.refresh_table()
 
+    def refresh_table(self):
+        """Show added folders, then folders being validated"""
+        data_sources = [data["path"] for data in self.data_preparator.data]
+        for path, num_labels in self.pending_folders.values():
+            data_sources.append(self.pending_folder_text(path, num_labels))
+        pd_frame = pd.DataFrame(
+            {DataSubsetTable.DATA_FOLDER_TITLE: data_sources}
+        )
+        self.model = TableModel(pd_frame)
+        self.data_sources_table.setModel(self.model)
         self.data_sources_table.clearSelection()
-        self.data_sources_table.dataChanged(
-            self.model.index(0, 0),
-            self.model.index(
-                self.model.rowCount(None), self.model.columnCount(None)
-            ),
+        self.cancel_scan_button.setVisible(len(self.pending_folders) > 0)
+
+    @staticmethod
+    def pending_folder_text(path, num_labels):
+        return f"{path} (scanning... {num_labels} labels found)"
+
+    def show_message(self, message):
+        corner = QtCore.Qt.Corner(QtCore.Qt.BottomRightCorner)
+        QToaster.show_message(
+            self,
+            message,
+            corner=corner,
+            timeout=3000,
+            closable=True,
         )
 
+    @QtCore.pyqtSlot(int, int)
+    def on_folder_progress(self, task_id, num_labels):
+        if task_id not in self.pending_folders:
+            return
+        path, _ = self.pending_folders[task_id]
+        self.pending_folders[task_id] = (path, num_labels)
+        row = len(self.data_preparator.data) + list(
+            self.pending_folders
+        ).index(task_id)
+        self.model.updateRow(
+            row,
+            {
+                DataSubsetTable.DATA_FOLDER_TITLE: self.pending_folder_text(
+                    path, num_labels
+                )
+            },
+        )
+
+    @QtCore.pyqtSlot(int, bool, object)
+    def on_folder_validated(self, task_id, ret, result):
+        if task_id not in self.pending_folders:
+            return
+        path, _ = self.pending_folders.pop(task_id)
+        if ret:
+            self.data_preparator.add_data_folder(result)
+        elif result != "Cancelled":
+            self.show_message(f"{result}: {path}")
+        self.refresh_table()
         self.update_statistics()
 
+    @QtCore.pyqtSlot()
+    def cancel_scan(self):
+        """Cancel validation of all pending folders"""
+        self.cancel_pending_folders()
+
+    def cancel_pending_folders(self, task_ids=None):
+        """Cancel validation of pending folders (default: all)"""
+        if task_ids is None:
+            task_ids = list(self.pending_folders)
+        for task_id in task_ids:
+            self.folder_validator.cancel(task_id)
+            self.pending_folders.pop(task_id, None)
+        self.refresh_table()
+
     def update_statistics(self):
         """Update data statistics"""
         data_size = 0
@@ -137,23 +202,28 @@ class DataSubsetTable(QWidget):
         if len(selected) == 0:
             return
         rows = [i.row() for i in selected]
-        self.data_preparator.remove_data_by_indices(rows)
-        self.data_sources_table.clearSelection()
-        self.data_sources_table.dataChanged(
-            self.model.index(0, 0),
-            self.model.index(
-                self.model.rowCount(None), self.model.columnCount(None)
-            ),
-        )
 
-        self.data_statistic.setText(
-            f"{self.data_preparator.size()} labeled images"
+        # Rows after the added folders are folders being validated
+        num_added = len(self.data_preparator.data)
+        pending_task_ids = list(self.pending_folders)
+        self.cancel_pending_folders(
+            [
+                pending_task_ids[row - num_added]
+                for row in rows
+                if row >= num_added
+            ]
         )
+        self.data_preparator.remove_data_by_indices(
+            [row for row in rows if row < num_added]
+        )
+        self.refresh_table()
+        self.update_statistics()
 
     @QtCore.pyqtSlot()
     def split_from_train_changed(self):
         self.split_from_train = self.split_from_train_checkbox.isChecked()
         if self.split_from_train:
+            self.cancel_pending_folders()
             data = pd.DataFrame({DataSubsetTable.DATA_FOLDER_TITLE: []})
             self.set_data(data)
             self.data_sources_table.setEnabled(False)
@@ -7,6 +7,9 @@ from PyQt5.QtCore import Qt, pyqtSignal, pyqtSlot
 from PyQt5.QtGui import QImage, QPixmap
 from PyQt5.QtWidgets import QFileDialog, QMessageBox, QWidget
 
+from traincv.common.image_metadata import (ImageMetadataError,
+                                           read_image_metadata)
+
 
 class EvaluationTab(QWidget):
 
@@ -78,8 +81,10 @@ class EvaluationTab(QWidget):
         if path:
             path = os.path.normpath(path)
             if os.path.isfile(path):
-                img = cv2.imread(path)
-                if img is None:
+                # Check the header only, the image is decoded for inference
+                try:
+                    read_image_metadata(path)
+                except ImageMetadataError:
                     self.image_view.setText(
                         f"Could not read image file: {path}"
                     )
@@ -112,20 +117,28 @@ class EvaluationTab(QWidget):
         else:
             self.image_view.setText("Running Inference...")
             frame = cv2.imread(self.image_list[self.current_image_id])
-            ret, result_frame = self.run_infer(frame)
-            if not ret:
+            if frame is None:
+                # Headers are checked on open, the pixels may still be
+                # unreadable by OpenCV
                 self.image_view.setText(
-                    "Failed to run inference on image:"
+                    "Could not read image file:"
                     f" {self.image_list[self.current_image_id]}"
                 )
-            rgb_image = cv2.cvtColor(result_frame, cv2.COLOR_BGR2RGB)
-            h, w, ch = rgb_image.shape
-            bytes_per_line = ch * w
-            convert_to_qt_format = QImage(
-                rgb_image.data, w, h, bytes_per_line, QImage.Format_RGB888
-            )
-            p = convert_to_qt_format.scaled(640, 480, Qt.KeepAspectRatio)
-            self.change_pixmap.emit(p)
+            else:
+                ret, result_frame = self.run_infer(frame)
+                if not ret:
+                    self.image_view.setText(
+                        "Failed to run inference on image:"
+                        f" {self.image_list[self.current_image_id]}"
+                    )
+                rgb_image = cv2.cvtColor(result_frame, cv2.COLOR_BGR2RGB)
+                h, w, ch = rgb_image.shape
+                bytes_per_line = ch * w
+                convert_to_qt_format = QImage(
+                    rgb_image.data, w, h, bytes_per_line, QImage.Format_RGB888
+                )
+                p = convert_to_qt_format.scaled(640, 480, Qt.KeepAspectRatio)
+                self.change_pixmap.emit(p)
 
         # Update button status
         self.prev_image_button.setEnabled(self.current_image_id > 0)